@@ -0,0 +1,28 @@
+'''
+Coroutine helpers of the async tests.
+
+Apart from tests_aio so that the test discovery of Python 2 can still
+import it: this module is only imported with psycopg 3.
+
+'''
+import asyncio
+
+
+async def _call(connect, func, args, kwargs):
+    async with await connect() as conn:
+        return await func(*(args[:2] + (conn,) + args[2:]), **kwargs)
+
+
+def call(connect, func, *args, **kwargs):
+    """Run `func(model, objects, conn, ...)` on a new connection."""
+    return asyncio.run(_call(connect, func, args, kwargs))
+
+
+def call_concurrently(connect, calls):
+    """Run the (func, args, kwargs) calls concurrently, each on its own
+    connection, and return their results."""
+    async def call_all():
+        return await asyncio.gather(
+            *[_call(connect, func, args, kwargs)
+              for func, args, kwargs in calls])
+    return asyncio.run(call_all())
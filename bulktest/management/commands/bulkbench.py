@@ -0,0 +1,295 @@
+'''
+Benchmark the bulk operations on synthetic rows.
+
+    $ python manage.py bulkbench --rows 100000 --columns 8 \
+        --types int,text,decimal --key-width 2 --duplicates 0.1 \
+        --existing 0.5 --batch-sizes 0,10000
+
+A table is created for a model with the requested key and value columns,
+every strategy of each operation is run on it for each batch size, and the
+table is dropped at the end.
+
+'''
+import datetime
+import decimal
+import itertools
+import random
+import string
+import uuid
+from timeit import default_timer as timer
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, models
+from django.utils.timezone import utc
+
+from djangobulk.bulk import (INSERT_METHODS, UPDATE_METHODS, UPSERT_METHODS,
+                             clear_write_plans, insert_many, update_many,
+                             insert_or_update_many)
+from djangobulk.tracing import Tracer
+
+
+OPERATIONS = ('insert', 'update', 'upsert')
+
+
+def _text(rnd):
+    return u''.join(rnd.choice(string.ascii_letters) for _ in range(16))
+
+
+def _datetime(rnd):
+    value = datetime.datetime(2000, 1, 1) + datetime.timedelta(
+        seconds=rnd.randint(0, 10 ** 9))
+    if settings.USE_TZ:
+        value = value.replace(tzinfo=utc)
+    return value
+
+
+# Field and random value of each column type
+COLUMN_TYPES = {
+    'int': (lambda: models.IntegerField(null=True),
+            lambda rnd: rnd.randint(-2 ** 31, 2 ** 31 - 1)),
+    'bigint': (lambda: models.BigIntegerField(null=True),
+               lambda rnd: rnd.randint(-2 ** 63, 2 ** 63 - 1)),
+    'text': (lambda: models.CharField(max_length=16, null=True), _text),
+    'decimal': (lambda: models.DecimalField(max_digits=12, decimal_places=2,
+                                            null=True),
+                lambda rnd: decimal.Decimal(rnd.randint(-10 ** 9, 10 ** 9))
+                / 100),
+    'float': (lambda: models.FloatField(null=True),
+              lambda rnd: rnd.random()),
+    'bool': (lambda: models.BooleanField(default=False),
+             lambda rnd: rnd.random() < 0.5),
+    'date': (lambda: models.DateField(null=True),
+             lambda rnd: datetime.date(2000, 1, 1) + datetime.timedelta(
+                 days=rnd.randint(0, 10000))),
+    'datetime': (lambda: models.DateTimeField(null=True), _datetime),
+    'uuid': (lambda: models.UUIDField(null=True),
+             lambda rnd: uuid.UUID(int=rnd.getrandbits(128))),
+}
+
+_model_names = itertools.count()
+
+
+def _bench_model(columns, types, key_width):
+    """Create a model with `key_width` integer key columns, unique together,
+    and `columns` value columns cycling through `types`."""
+    key_names = ['k%d' % i for i in range(key_width)]
+    attrs = dict((name, models.IntegerField()) for name in key_names)
+    for i in range(columns):
+        column_type = types[i % len(types)]
+        attrs['v%d_%s' % (i, column_type)] = COLUMN_TYPES[column_type][0]()
+
+    attrs['__module__'] = __name__
+    attrs['Meta'] = type('Meta', (object,), dict(
+        app_label='bulktest', db_table='bulkbench_row',
+        unique_together=[key_names]))
+    return type('BenchRow%d' % next(_model_names), (models.Model,), attrs)
+
+
+def _time(func, model, objects, kwargs):
+    """Return the seconds taken by `func(model, objects, **kwargs)`."""
+    start = timer()
+    func(model, objects, **kwargs)
+    return timer() - start
+
+
+def _ratio(value):
+    value = float(value)
+    if not 0 <= value <= 1:
+        raise CommandError("Ratios must be between 0 and 1")
+    return value
+
+
+class Command(BaseCommand):
+    help = ("Time insert_many, update_many and insert_or_update_many with "
+            "every strategy and batch size on synthetic rows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=10000,
+            help="Number of rows written by each run.")
+        parser.add_argument(
+            '--columns', type=int, default=4,
+            help="Number of value columns.")
+        parser.add_argument(
+            '--types', default='int,text',
+            help="Comma separated types of the value columns, cycled "
+                 "through: %s." % ', '.join(sorted(COLUMN_TYPES)))
+        parser.add_argument(
+            '--key-width', type=int, default=1,
+            help="Number of integer key columns.")
+        parser.add_argument(
+            '--duplicates', type=_ratio, default=0.0,
+            help="Ratio of rows repeating the key of another row, for the "
+                 "updates and upserts.")
+        parser.add_argument(
+            '--existing', type=_ratio, default=0.5,
+            help="Ratio of the keys in the table before the updates and "
+                 "upserts.")
+        parser.add_argument(
+            '--batch-sizes', default='0,1000',
+            help="Comma separated batch sizes, 0 for a single batch.")
+        parser.add_argument(
+            '--operations', default=','.join(OPERATIONS),
+            help="Comma separated operations among: %s."
+                 % ', '.join(OPERATIONS))
+        parser.add_argument(
+            '--no-memory', action='store_false', dest='memory',
+            help="Do not trace the peak memory, which slows Python down. "
+                 "Never traced on Python 2.")
+        parser.add_argument(
+            '--no-statements', action='store_false', dest='statements',
+            help="Do not count the statements, which are counted by tracing "
+                 "the timed call, measuring its rows and parameters.")
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="Seed of the random values.")
+        parser.add_argument(
+            '--database', default='default',
+            help="Database to benchmark on.")
+
+    def handle(self, **options):
+        types = options['types'].split(',')
+        unknown = set(types) - set(COLUMN_TYPES)
+        if unknown:
+            raise CommandError("Unknown column types: %s"
+                               % ', '.join(sorted(unknown)))
+        operations = options['operations'].split(',')
+        unknown = set(operations) - set(OPERATIONS)
+        if unknown:
+            raise CommandError("Unknown operations: %s"
+                               % ', '.join(sorted(unknown)))
+        if options['rows'] < 1 or options['key_width'] < 1:
+            raise CommandError("rows and key-width must be positive")
+        if options['columns'] < 0:
+            raise CommandError("columns must not be negative")
+        try:
+            batch_sizes = [int(size) or None
+                           for size in options['batch_sizes'].split(',')]
+        except ValueError:
+            raise CommandError("Batch sizes must be integers")
+
+        self.using = options['database']
+        # tracemalloc is Python 3
+        self.memory = options['memory'] and tracemalloc is not None
+        self.statements = options['statements']
+        con = connections[self.using]
+        model = _bench_model(options['columns'], types,
+                             options['key_width'])
+        self.rnd = random.Random(options['seed'])
+
+        with con.schema_editor() as editor:
+            editor.create_model(model)
+        try:
+            self.stdout.write("%-7s %-12s %6s %8s %9s %10s %10s %9s" % (
+                'op', 'method', 'batch', 'rows', 'seconds', 'rows/s',
+                'statements', 'peak MiB'))
+            for operation in operations:
+                self.bench(con, model, operation, batch_sizes,
+                           options['rows'], options['duplicates'],
+                           options['existing'])
+        finally:
+            with con.schema_editor() as editor:
+                editor.delete_model(model)
+            clear_write_plans()
+
+    def objects(self, model, ids):
+        """Build an object of `model` with random values for each key id."""
+        fields = model._meta.fields
+        key_fields = [f for f in fields if f.name.startswith('k')]
+        value_fields = [(f, COLUMN_TYPES[f.name.split('_', 1)[1]][1])
+                        for f in fields if f.name.startswith('v')]
+        objects = []
+        for i in ids:
+            values = dict((f.attname, i * (n + 1) % 2 ** 31)
+                          for n, f in enumerate(key_fields))
+            values.update((f.attname, random_value(self.rnd))
+                          for f, random_value in value_fields)
+            objects.append(model(**values))
+        return objects
+
+    def bench(self, con, model, operation, batch_sizes, rows, duplicates,
+              existing):
+        postgresql = con.vendor == 'postgresql'
+        key_names = [f.name for f in model._meta.fields
+                     if f.name.startswith('k')]
+
+        if operation == 'insert':
+            methods = INSERT_METHODS if postgresql else ('executemany',)
+            objects = self.objects(model, range(rows))
+            prefill = []
+        else:
+            num_unique = rows - int(rows * duplicates)
+            ids = list(range(num_unique))
+            ids.extend(self.rnd.randrange(num_unique)
+                       for _ in range(rows - num_unique))
+            self.rnd.shuffle(ids)
+            objects = self.objects(model, ids)
+            prefill = self.objects(model, range(int(num_unique * existing)))
+
+        if operation == 'update':
+            methods = UPDATE_METHODS if postgresql else ('executemany',)
+        elif operation == 'upsert':
+            methods = UPSERT_METHODS if postgresql else ('select',)
+
+        for method in methods:
+            for batch_size in batch_sizes:
+                if operation == 'insert':
+                    func, kwargs = insert_many, dict(method=method)
+                elif operation == 'update':
+                    func, kwargs = update_many, dict(keys=key_names,
+                                                     method=method)
+                else:
+                    func, kwargs = insert_or_update_many, dict(
+                        keys=key_names, method=method)
+                kwargs.update(using=self.using, batch_size=batch_size)
+
+                elapsed, statements, peak = self.run(
+                    con, model, prefill, func, objects, kwargs)
+                self.stdout.write(
+                    "%-7s %-12s %6s %8d %9.3f %10.0f %10s %9s" % (
+                        operation, method, batch_size or 'all',
+                        len(objects), elapsed,
+                        len(objects) / elapsed if elapsed else 0,
+                        '-' if statements is None else statements,
+                        '%.1f' % (peak / 2.0 ** 20) if self.memory
+                        else '-'))
+
+    def run(self, con, model, prefill, func, objects, kwargs):
+        """Time a run of `func` on the table holding only `prefill`.
+
+        :returns: A tuple with the elapsed seconds, the number of statements,
+            None if not counted, and the peak traced memory in bytes.
+        """
+        table = con.ops.quote_name(model._meta.db_table)
+        cursor = con.cursor()
+        if con.vendor == 'postgresql':
+            cursor.execute("TRUNCATE %s" % table)
+        else:
+            cursor.execute("DELETE FROM %s" % table)
+        insert_many(model, prefill, using=self.using)
+
+        peak, statements = 0, None
+        if self.memory:
+            tracemalloc.start()
+        try:
+            if self.statements:
+                with Tracer() as tracer:
+                    elapsed = _time(func, model, objects, kwargs)
+                statements = sum(p.statements for p in tracer.phases
+                                 if p.name == 'call')
+            else:
+                elapsed = _time(func, model, objects, kwargs)
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            if self.memory:
+                tracemalloc.stop()
+
+        return (elapsed, statements, peak)
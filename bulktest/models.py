@@ -1,4 +1,7 @@
+import datetime
+
 from django.db import models
+from djangobulk.tracking import DirtyFieldsMixin
 
 
 class TestModelA(models.Model):
@@ -7,6 +10,25 @@ class TestModelA(models.Model):
     c = models.IntegerField()
 
 
+class TestModelUnique(models.Model):
+    """Model with a unique index on its natural key."""
+
+    a = models.CharField(max_length=200)
+    b = models.IntegerField()
+    c = models.IntegerField()
+
+    class Meta:
+        unique_together = ('a', 'b')
+
+
+class TestModelDirty(DirtyFieldsMixin, models.Model):
+    """Model with dirty field tracking."""
+
+    a = models.CharField(max_length=200)
+    b = models.IntegerField()
+    c = models.IntegerField()
+
+
 class TestModelPreSave(models.Model):
     """Model that defines the presave method."""
 
@@ -19,4 +41,45 @@ class TestModelPreSave(models.Model):
 class TestModelAutoCreated(models.Model):
     a = models.CharField(max_length=200)
     b = models.IntegerField()
-    created = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class TestModelTypes(models.Model):
+    """Model covering the field types handled by the COPY insert method."""
+
+    text = models.TextField(null=True)
+    number = models.IntegerField(null=True)
+    decimal = models.DecimalField(max_digits=10, decimal_places=3, null=True)
+    real = models.FloatField(null=True)
+    flag = models.NullBooleanField()
+    day = models.DateField(null=True)
+    moment = models.DateTimeField(null=True)
+    if hasattr(models, 'UUIDField'):
+        # Django >= 1.8
+        duration = models.DurationField(null=True)
+        uuid = models.UUIDField(null=True)
+    if hasattr(models, 'BinaryField'):
+        # Django >= 1.6
+        data = models.BinaryField(null=True)
+
+
+class StampField(models.DateTimeField):
+    """DateTimeField setting a fixed time in its own pre_save."""
+
+    STAMP = datetime.datetime(2000, 1, 1, 12, 0)
+
+    def pre_save(self, model_instance, add):
+        setattr(model_instance, self.attname, self.STAMP)
+        return self.STAMP
+
+
+class TestModelStamped(models.Model):
+    a = models.IntegerField()
+    stamp = StampField(null=True)
+
+
+class TestModelEvent(models.Model):
+    """Model keyed by a unique timestamp."""
+
+    moment = models.DateTimeField(unique=True)
+    c = models.IntegerField()
@@ -14,4 +14,5 @@ SECRET_KEY = 'fake-key'
 
 INSTALLED_APPS = [
     'bulktest',
+    'djangobulk',
 ]
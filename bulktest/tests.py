@@ -1,6 +1,59 @@
-from django.test import TestCase
-from bulktest.models import TestModelA, TestModelPreSave, TestModelAutoCreated
-from djangobulk.bulk import insert_many, update_many, insert_or_update_many
+import datetime
+import decimal
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+try:
+    # Python 2: management commands write str
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import django
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+try:
+    from django.db import DataError
+except ImportError:
+    # Django < 1.6
+    from django.db import DatabaseError as DataError
+from django.db import models
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+try:
+    from django.test.utils import CaptureQueriesContext
+except ImportError:
+    # Django < 1.6, which is skipped by the tests using it
+    CaptureQueriesContext = None
+from django.utils.timezone import utc
+from bulktest.models import (StampField, TestModelA, TestModelPreSave,
+                             TestModelAutoCreated, TestModelTypes,
+                             TestModelUnique, TestModelDirty,
+                             TestModelEvent, TestModelStamped)
+from djangobulk.bulk import (insert_many, update_many, insert_or_update_many,
+                             delete_many, sync_many, get_write_plan,
+                             clear_write_plans, INSERT_METHODS)
+from djangobulk.importer import bulk_import
+from djangobulk.parallel import (parallel_insert_or_update_many,
+                                 ParallelWriteError)
+from djangobulk.statements import clear_prepared_statements
+from djangobulk.tracing import Tracer, add_listener, remove_listener
+
+# TestModelTypes has UUID, duration and binary fields on Django >= 1.8
+requires_field_types = unittest.skipUnless(
+    hasattr(models, 'UUIDField'), "Django < 1.8 has no UUIDField")
+
+# Objects loaded from the database are tracked on Django >= 1.8
+requires_from_db = unittest.skipUnless(
+    hasattr(models.Model, 'from_db'), "Django < 1.8 has no Model.from_db")
+
+# Management commands parse their options with argparse on Django >= 1.8
+requires_argparse_commands = unittest.skipIf(
+    django.VERSION < (1, 8), "Django < 1.8 has no argparse commands")
 
 
 class InsertTest(TestCase):
@@ -42,6 +95,105 @@ class InsertTest(TestCase):
         self.assertEqual(n.b, 1)
         self.assertTrue(n.created)
 
+    def test_insert_values_method(self):
+        set1 = [TestModelA(a="Test", b=i, c=1) for i in range(25)]
+        entries = insert_many(TestModelA, set1, method='values',
+                              rows_per_statement=10, skip_result=False)
+        self.assertEqual(25, TestModelA.objects.all().count())
+        self.assertEqual(25, len(entries))
+        self.assertEqual(list(range(25)), sorted(
+            TestModelA.objects.values_list('b', flat=True)))
+
+    def test_insert_result_formats(self):
+        set1 = [TestModelA(a="Test", b=i, c=1) for i in range(5)]
+        self.assertEqual(5, insert_many(TestModelA, set1, skip_result=False,
+                                        batch_size=2, result='counts'))
+        columns = insert_many(TestModelA, set1, skip_result=False,
+                              result='columns')
+        self.assertEqual(['a', 'b', 'c'], list(columns))
+        self.assertEqual(list(range(5)), columns['b'])
+        # Counted as sent, without skip_result=False
+        for method in INSERT_METHODS:
+            self.assertEqual(5, insert_many(TestModelA, iter(set1),
+                                            method=method, batch_size=2,
+                                            result='counts'))
+        self.assertEqual(0, insert_many(TestModelA, [], result='counts'))
+
+    def test_insert_values_parameter_limit(self):
+        set1 = [TestModelA(a="Test", b=i, c=1) for i in range(10)]
+        insert_many(TestModelA, set1, method='values', max_parameters=7)
+        self.assertEqual(10, TestModelA.objects.all().count())
+
+    def test_insert_executemany_method(self):
+        set1 = [TestModelA(a="Test", b=i, c=1) for i in range(5)]
+        insert_many(TestModelA, set1, method='executemany')
+        self.assertEqual(5, TestModelA.objects.all().count())
+
+    def test_insert_copy_method(self):
+        set1 = [TestModelA(a="Test", b=i, c=1) for i in range(5)]
+        entries = insert_many(TestModelA, set1, method='copy',
+                              skip_result=False)
+        self.assertEqual(5, TestModelA.objects.all().count())
+        self.assertEqual(5, len(entries))
+        self.assertEqual(entries[0]['a'], 'Test')
+
+    def test_insert_copy_escaping(self):
+        values = ["tab\there", "new\nline", "carriage\rreturn",
+                  "back\\slash", "\\N", ""]
+        set1 = [TestModelTypes(text=v) for v in values]
+        set1.append(TestModelTypes(text=None))
+        insert_many(TestModelTypes, set1, method='copy')
+
+        stored = list(TestModelTypes.objects.order_by('id')
+                      .values_list('text', flat=True))
+        self.assertEqual(values + [None], stored)
+
+    @requires_field_types
+    def test_insert_copy_field_types(self):
+        n = TestModelTypes(
+            text="Test",
+            number=-3,
+            decimal=decimal.Decimal("12.345"),
+            real=0.1,
+            flag=False,
+            day=datetime.date(2016, 2, 29),
+            moment=datetime.datetime(2016, 2, 29, 12, 30, 15, 123456),
+            duration=datetime.timedelta(days=-1, seconds=5, microseconds=7),
+            uuid=uuid.UUID("12345678-1234-5678-1234-567812345678"),
+            data=b"\x00\t\\binary",
+        )
+        insert_many(TestModelTypes, [n, TestModelTypes()], method='copy')
+
+        m = TestModelTypes.objects.exclude(text=None).get()
+        for field in ('text', 'number', 'decimal', 'real', 'flag', 'day',
+                      'duration', 'uuid'):
+            self.assertEqual(getattr(n, field), getattr(m, field))
+        self.assertEqual(n.moment, m.moment.replace(tzinfo=None))
+        self.assertEqual(n.data, bytes(m.data))
+
+        m = TestModelTypes.objects.get(text=None)
+        self.assertEqual(None, m.number)
+        self.assertEqual(None, m.uuid)
+        self.assertEqual(None, m.data)
+
+    def test_insert_set_pks(self):
+        set1 = [TestModelA(a="Test", b=i, c=1) for i in range(25)]
+        insert_many(TestModelA, set1, set_pks=True, rows_per_statement=10)
+
+        for n in set1:
+            self.assertFalse(n._state.adding)
+            self.assertEqual(n.b, TestModelA.objects.get(pk=n.pk).b)
+
+    def test_insert_set_pks_method(self):
+        n = TestModelA(a="Test", b=1, c=2)
+        self.assertRaises(ValueError, insert_many, TestModelA, [n],
+                          method='copy', set_pks=True)
+
+    def test_insert_unknown_method(self):
+        n = TestModelA(a="Test", b=1, c=2)
+        self.assertRaises(ValueError, insert_many, TestModelA, [n],
+                          method='unknown')
+
 
 class UpdateTest(TestCase):
     def test_basic_update(self):
@@ -193,6 +345,102 @@ class UpdateTest(TestCase):
         self.assertEqual(n.b, 1)
         self.assertEqual(n.c, 2)
 
+    def test_update_values_method(self):
+        set1 = [TestModelA(a="Test%d" % i, b=i, c=1) for i in range(25)]
+        insert_many(TestModelA, set1)
+
+        set2 = [TestModelA(a="Test%d" % i, b=i, c=i) for i in range(25)]
+        set2.append(TestModelA(a="Test0", b=0, c=100))
+        update_many(TestModelA, set2, keys=['a'], method='values',
+                    rows_per_statement=10)
+
+        self.assertEqual(100, TestModelA.objects.get(a="Test0").c)
+        for i in range(1, 25):
+            self.assertEqual(i, TestModelA.objects.get(a="Test%d" % i).c)
+
+    def test_update_values_too_long(self):
+        n = TestModelA(a="Test", b=1, c=2)
+        n.save()
+
+        # Not truncated to max_length by the cast of the VALUES
+        n.a = "x" * 250
+        sid = transaction.savepoint()
+        self.assertRaises(DataError, update_many, TestModelA, [n],
+                          method='values')
+        transaction.savepoint_rollback(sid)
+        self.assertEqual("Test", TestModelA.objects.get().a)
+
+    def test_update_executemany_method(self):
+        n = TestModelA(a="Test", b=1, c=2)
+        n.save()
+
+        n.c = 4
+        update_many(TestModelA, [n], method='executemany')
+        self.assertEqual(4, TestModelA.objects.get().c)
+
+    @requires_field_types
+    def test_update_values_field_types(self):
+        n = TestModelTypes(text="Test")
+        n.save()
+
+        n.number = 3
+        n.decimal = decimal.Decimal("1.5")
+        n.day = datetime.date(2016, 2, 29)
+        n.moment = datetime.datetime(2016, 2, 29, 12, 30)
+        n.uuid = uuid.UUID("12345678-1234-5678-1234-567812345678")
+        update_many(TestModelTypes, [n], keys=['text'], method='values')
+
+        m = TestModelTypes.objects.get()
+        for field in ('number', 'decimal', 'day', 'uuid', 'real', 'flag'):
+            self.assertEqual(getattr(n, field), getattr(m, field))
+        self.assertEqual(n.moment, m.moment.replace(tzinfo=None))
+
+    def test_update_skip_unchanged(self):
+        set1 = [TestModelA(a="Test%d" % i, b=i, c=1) for i in range(10)]
+        insert_many(TestModelA, set1)
+
+        set2 = [TestModelA(a="Test%d" % i, b=i, c=i % 2) for i in range(12)]
+        result = update_many(TestModelA, set2, keys=['a'],
+                             skip_unchanged=True, rows_per_statement=4)
+        # 5 rows changed, 5 unchanged and 2 not found
+        self.assertEqual((5, 7), result)
+        self.assertEqual(5, TestModelA.objects.filter(c=0).count())
+        self.assertEqual(5, TestModelA.objects.filter(c=1).count())
+
+    def test_update_skip_unchanged_null(self):
+        n = TestModelTypes(text="Test", number=None)
+        n.save()
+
+        n.number = 1
+        self.assertEqual((1, 0), update_many(TestModelTypes, [n],
+                                             skip_unchanged=True))
+        self.assertEqual((0, 1), update_many(TestModelTypes, [n],
+                                             skip_unchanged=True))
+        n.number = None
+        self.assertEqual((1, 0), update_many(TestModelTypes, [n],
+                                             skip_unchanged=True))
+        self.assertEqual(None, TestModelTypes.objects.get().number)
+
+    @override_settings(USE_TZ=True)
+    def test_update_skip_unchanged_aware_keys(self):
+        n = TestModelEvent(
+            moment=datetime.datetime(2016, 2, 29, 12, 30, tzinfo=utc), c=1)
+        n.save()
+
+        n.c = 2
+        self.assertEqual((1, 0), update_many(TestModelEvent, [n],
+                                             keys=['moment'],
+                                             skip_unchanged=True))
+        self.assertEqual((0, 1), update_many(TestModelEvent, [n],
+                                             keys=['moment'],
+                                             skip_unchanged=True))
+        self.assertEqual(2, TestModelEvent.objects.get().c)
+
+    def test_update_unknown_method(self):
+        n = TestModelA(a="Test", b=1, c=2)
+        self.assertRaises(ValueError, update_many, TestModelA, [n],
+                          method='unknown')
+
 
 class InsertUpdateTest(TestCase):
     def test_basic_insert_update(self):
@@ -308,6 +556,64 @@ class InsertUpdateTest(TestCase):
         self.assertTrue(isinstance(inserted[0], dict))
         self.assertTrue(isinstance(updated[0], dict))
 
+    def test_batched_insert_update(self):
+        set1 = [TestModelA(a="Test", b=i, c=1) for i in range(100)]
+        insert_many(TestModelA, set1, batch_size=30)
+        self.assertEqual(100, TestModelA.objects.all().count())
+
+        set2 = [TestModelA(a="Test", b=i, c=2) for i in range(50, 200)]
+        inserted, updated = insert_or_update_many(TestModelA, set2,
+                                                  keys=['b'], batch_size=40)
+        self.assertEqual(200, TestModelA.objects.all().count())
+        self.assertEqual(100, len(inserted))
+        self.assertEqual(50, len(updated))
+        self.assertEqual(150, TestModelA.objects.filter(c=2).count())
+
+        set3 = [TestModelA(a="Test", b=i, c=3) for i in range(200)]
+        update_many(TestModelA, set3, keys=['b'], batch_size=64)
+        self.assertEqual(200, TestModelA.objects.filter(c=3).count())
+
+    def test_batched_results(self):
+        set1 = [TestModelA(a="Test", b=i, c=1) for i in range(10)]
+        entries = insert_many(TestModelA, set1, skip_result=False,
+                              batch_size=3)
+        self.assertEqual([e.b for e in set1], [e['b'] for e in entries])
+
+    def test_invalid_batch_size(self):
+        n = TestModelA(a="Test", b=1, c=2)
+        self.assertRaises(ValueError, insert_many, TestModelA, [n],
+                          batch_size=0)
+        self.assertRaises(ValueError, insert_or_update_many, TestModelA,
+                          [n], batch_size=0)
+
+    def test_insert_update_skip_unchanged(self):
+        set1 = [TestModelA(a="Test", b=i, c=1) for i in range(10)]
+        insert_many(TestModelA, set1)
+
+        set2 = [TestModelA(a="Test", b=i, c=i % 2) for i in range(15)]
+        inserted, updated, unchanged = insert_or_update_many(
+            TestModelA, set2, keys=['b'], skip_unchanged=True)
+        self.assertEqual(5, len(inserted))
+        self.assertEqual([0, 2, 4, 6, 8], sorted(r['b'] for r in updated))
+        self.assertEqual([1, 3, 5, 7, 9], sorted(r['b'] for r in unchanged))
+        self.assertEqual(15, TestModelA.objects.all().count())
+
+    @requires_field_types
+    def test_insert_update_field_type_keys(self):
+        moment = datetime.datetime(2016, 2, 29, 12, 30)
+        key = uuid.UUID("12345678-1234-5678-1234-567812345678")
+        TestModelTypes(text="Test", moment=moment, uuid=key, number=1).save()
+
+        set1 = [
+            TestModelTypes(text="Test", moment=moment, uuid=key, number=2),
+            TestModelTypes(text="Test", moment=moment, uuid=None, number=3),
+        ]
+        inserted, updated = insert_or_update_many(
+            TestModelTypes, set1, keys=['text', 'moment', 'uuid'])
+        self.assertEqual(1, len(inserted))
+        self.assertEqual(1, len(updated))
+        self.assertEqual(2, TestModelTypes.objects.get(uuid=key).number)
+
     def test_duplicate_insert_update(self):
         set1 = [
             TestModelA(a="Test1", b=1, c=1),
@@ -319,6 +625,840 @@ class InsertUpdateTest(TestCase):
         self.assertEqual(2, TestModelA.objects.all().count())
         self.assertEqual(3, TestModelA.objects.get(a="Test2").c)
 
+    def test_dedup_first(self):
+        TestModelUnique(a="Test1", b=1, c=1).save()
+        for method in ('select', 'on_conflict', 'staging'):
+            set1 = [
+                TestModelUnique(a="Test1", b=1, c=2),
+                TestModelUnique(a="Test2", b=2, c=2),
+                TestModelUnique(a="Test2", b=2, c=3),
+                TestModelUnique(a="Test1", b=1, c=3),
+                ]
+            inserted, updated = insert_or_update_many(
+                TestModelUnique, set1, keys=['a', 'b'], method=method,
+                dedup='first')
+            self.assertEqual(2, TestModelUnique.objects.count())
+            self.assertEqual(2, TestModelUnique.objects.get(a="Test1").c)
+            self.assertEqual(2, TestModelUnique.objects.get(a="Test2").c)
+            self.assertEqual(1, len(updated))
+            TestModelUnique.objects.filter(a="Test2").delete()
+
+    def test_dedup_raise(self):
+        set1 = [
+            TestModelUnique(a="Test1", b=1, c=1),
+            TestModelUnique(a="Test2", b=2, c=2),
+            TestModelUnique(a="Test2", b=2, c=3),
+            ]
+        for method in ('select', 'on_conflict', 'staging'):
+            with self.assertRaises(ValueError):
+                insert_or_update_many(TestModelUnique, set1,
+                                      keys=['a', 'b'], method=method,
+                                      dedup='raise')
+            self.assertEqual(0, TestModelUnique.objects.count())
+
+        insert_or_update_many(TestModelUnique, set1[:2], keys=['a', 'b'],
+                              dedup='raise')
+        self.assertEqual(2, TestModelUnique.objects.count())
+        self.assertRaises(ValueError, insert_or_update_many, TestModelUnique,
+                          set1, keys=['a', 'b'], dedup='any')
+
+    def test_result_formats(self):
+        insert_many(TestModelA, [TestModelA(a="Test1", b=1, c=1)])
+        set1 = [TestModelA(a="Test1", b=1, c=2),
+                TestModelA(a="Test2", b=2, c=2)]
+
+        inserted, updated = insert_or_update_many(
+            TestModelA, set1, keys=['a'], update_fields=['c'],
+            result='counts')
+        self.assertEqual((1, 1), (inserted, updated))
+
+        inserted, updated = insert_or_update_many(
+            TestModelA, set1, keys=['a'], update_fields=['c'],
+            result='tuples')
+        self.assertEqual((('a', 'b', 'c'), []), inserted)
+        self.assertEqual((('c', 'a'), [(2, "Test1"), (2, "Test2")]),
+                         updated)
+
+        inserted, updated, unchanged = insert_or_update_many(
+            TestModelA, set1 + [TestModelA(a="Test3", b=3, c=3)],
+            keys=['a'], update_fields=['c'], skip_unchanged=True,
+            result='columns')
+        self.assertEqual({'a': ["Test3"], 'b': [3], 'c': [3]}, inserted)
+        self.assertEqual({'c': [], 'a': []}, updated)
+        self.assertEqual({'c': [2, 2], 'a': ["Test1", "Test2"]}, unchanged)
+
+        inserted, updated = insert_or_update_many(
+            TestModelA, [TestModelA(a="Test4", b=4, c=4)], keys=['a'],
+            result='iterator', batch_size=1)
+        self.assertEqual([{'a': "Test4", 'b': 4, 'c': 4}], list(inserted))
+        self.assertEqual([], list(updated))
+
+        self.assertRaises(ValueError, insert_or_update_many, TestModelA,
+                          set1, keys=['a'], result='rows')
+
+    def test_insert_keys_prepared_once(self):
+        calls = []
+        plan = get_write_plan(TestModelA, keys=['b'])
+        prepare_keys = plan.prepare_keys
+        plan.prepare_keys = lambda o, con: calls.append(o) or \
+            prepare_keys(o, con)
+        try:
+            insert_or_update_many(TestModelA, [TestModelA(a="Test", b=i, c=1)
+                                               for i in range(3)],
+                                  keys=['b'])
+        finally:
+            plan.prepare_keys = prepare_keys
+        self.assertEqual(3, len(calls))
+        self.assertEqual(3, TestModelA.objects.count())
+
+    @override_settings(USE_TZ=True)
+    def test_insert_update_aware_keys(self):
+        moment = datetime.datetime(2016, 2, 29, 12, 30, tzinfo=utc)
+        TestModelEvent(moment=moment, c=1).save()
+        for c, method in enumerate(('select', 'on_conflict', 'staging'), 2):
+            self.assertEqual((0, 1), insert_or_update_many(
+                TestModelEvent, [TestModelEvent(moment=moment, c=c)],
+                keys=['moment'], method=method, result='counts'))
+            self.assertEqual(c, TestModelEvent.objects.get().c)
+
+
+class OnConflictTest(TestCase):
+    def setUp(self):
+        insert_many(TestModelUnique, [
+            TestModelUnique(a="Test1", b=1, c=1),
+            TestModelUnique(a="Test2", b=2, c=2),
+        ])
+
+    def test_on_conflict_insert_update(self):
+        set2 = [
+            TestModelUnique(a="Test1", b=1, c=3),
+            TestModelUnique(a="Test2", b=3, c=4),
+            TestModelUnique(a="Test3", b=3, c=3),
+            ]
+
+        inserted, updated = insert_or_update_many(
+            TestModelUnique, set2, keys=['a', 'b'], method='on_conflict')
+        self.assertEqual(4, TestModelUnique.objects.all().count())
+        self.assertEqual(3, TestModelUnique.objects.get(a="Test1", b=1).c)
+        self.assertEqual(2, TestModelUnique.objects.get(a="Test2", b=2).c)
+
+        self.assertEqual(2, len(inserted))
+        self.assertEqual(1, len(updated))
+        self.assertEqual({'a': "Test1", 'b': 1, 'c': 3}, updated[0])
+        self.assertEqual(set(["Test2", "Test3"]),
+                         set(row['a'] for row in inserted))
+
+    def test_on_conflict_skip_update(self):
+        set2 = [
+            TestModelUnique(a="Test1", b=1, c=3),
+            TestModelUnique(a="Test3", b=3, c=3),
+            ]
+
+        inserted, updated = insert_or_update_many(
+            TestModelUnique, set2, keys=['a', 'b'], skip_update=True,
+            method='on_conflict')
+        self.assertEqual(3, TestModelUnique.objects.all().count())
+        self.assertEqual(1, TestModelUnique.objects.get(a="Test1", b=1).c)
+        self.assertEqual(1, len(inserted))
+        self.assertEqual([], updated)
+
+    def test_on_conflict_skip_unchanged(self):
+        set2 = [
+            TestModelUnique(a="Test1", b=1, c=1),
+            TestModelUnique(a="Test2", b=2, c=3),
+            TestModelUnique(a="Test3", b=3, c=3),
+            ]
+
+        inserted, updated, unchanged = insert_or_update_many(
+            TestModelUnique, set2, keys=['a', 'b'], skip_unchanged=True,
+            method='on_conflict')
+        self.assertEqual(["Test3"], [r['a'] for r in inserted])
+        self.assertEqual(["Test2"], [r['a'] for r in updated])
+        self.assertEqual(["Test1"], [r['a'] for r in unchanged])
+        self.assertEqual(3, TestModelUnique.objects.get(a="Test2").c)
+
+    def test_on_conflict_update_fields(self):
+        n = TestModelUnique(a="Test1", b=1, c=3)
+        insert_or_update_many(TestModelUnique, [n], keys=['a', 'b'],
+                              exclude_fields=['c'], method='on_conflict')
+        self.assertEqual(1, TestModelUnique.objects.get(a="Test1", b=1).c)
+
+    def test_on_conflict_duplicates(self):
+        set2 = [
+            TestModelUnique(a="Test1", b=1, c=3),
+            TestModelUnique(a="Test1", b=1, c=4),
+            TestModelUnique(a="Test3", b=3, c=3),
+            TestModelUnique(a="Test3", b=3, c=5),
+            ]
+
+        insert_or_update_many(TestModelUnique, set2, keys=['a', 'b'],
+                              method='on_conflict')
+        self.assertEqual(3, TestModelUnique.objects.all().count())
+        self.assertEqual(4, TestModelUnique.objects.get(a="Test1").c)
+        self.assertEqual(5, TestModelUnique.objects.get(a="Test3").c)
+
+    def test_on_conflict_auto_pk(self):
+        n = TestModelUnique(a="Test1", b=1, c=3)
+        self.assertRaises(ValueError, insert_or_update_many, TestModelUnique,
+                          [n], method='on_conflict')
+
+
+class StagingTest(TestCase):
+    def setUp(self):
+        insert_many(TestModelA, [
+            TestModelA(a="Test1", b=1, c=1),
+            TestModelA(a="Test2", b=2, c=2),
+        ])
+
+    def test_staging_insert_update(self):
+        set2 = [
+            TestModelA(a="Test1", b=1, c=3),
+            TestModelA(a="Test2", b=3, c=4),
+            TestModelA(a="Test3", b=3, c=3),
+            TestModelA(a="Test3", b=3, c=5),
+            ]
+
+        inserted, updated = insert_or_update_many(
+            TestModelA, set2, keys=['a', 'b'], method='staging')
+        self.assertEqual(4, TestModelA.objects.all().count())
+        self.assertEqual(3, TestModelA.objects.get(a="Test1").c)
+        self.assertEqual(2, TestModelA.objects.get(a="Test2", b=2).c)
+        self.assertEqual(5, TestModelA.objects.get(a="Test3").c)
+
+        self.assertEqual([{'a': "Test1", 'b': 1, 'c': 3}], updated)
+        self.assertEqual([("Test2", 3, 4), ("Test3", 3, 5)], sorted(
+            (r['a'], r['b'], r['c']) for r in inserted))
+
+    def test_staging_skip_update(self):
+        set2 = [
+            TestModelA(a="Test1", b=1, c=3),
+            TestModelA(a="Test3", b=3, c=3),
+            ]
+
+        inserted, updated = insert_or_update_many(
+            TestModelA, set2, keys=['a'], skip_update=True,
+            method='staging', batch_size=1)
+        self.assertEqual(1, TestModelA.objects.get(a="Test1").c)
+        self.assertEqual(1, len(inserted))
+        self.assertEqual([], updated)
+
+    def test_staging_skip_unchanged(self):
+        set2 = [
+            TestModelA(a="Test1", b=1, c=1),
+            TestModelA(a="Test2", b=2, c=3),
+            ]
+
+        inserted, updated, unchanged = insert_or_update_many(
+            TestModelA, set2, keys=['a'], skip_unchanged=True,
+            method='staging')
+        self.assertEqual([], inserted)
+        self.assertEqual(["Test2"], [r['a'] for r in updated])
+        self.assertEqual(["Test1"], [r['a'] for r in unchanged])
+
+
+class RawRowsTest(TestCase):
+    def test_insert_tuples(self):
+        rows = [("Test", i, 1) for i in range(5)]
+        for method in INSERT_METHODS:
+            insert_many(TestModelA, rows, columns=['a', 'b', 'c'],
+                        method=method)
+        self.assertEqual(15, TestModelA.objects.count())
+
+    def test_insert_defaults_and_conversion(self):
+        moment = datetime.datetime(2016, 2, 29, 12, 30)
+        rows = iter([{'number': "3", 'moment': moment, 'decimal': "1.5"}])
+        insert_many(TestModelTypes, rows,
+                    columns=['number', 'moment', 'decimal'])
+        n = TestModelTypes.objects.get()
+        self.assertEqual(3, n.number)
+        self.assertEqual(decimal.Decimal("1.5"), n.decimal)
+        self.assertEqual(moment, n.moment)
+        self.assertEqual(None, n.text)
+
+        insert_many(TestModelAutoCreated, [("Test", 1)], columns=['a', 'b'])
+        self.assertTrue(TestModelAutoCreated.objects.get().created)
+
+    @override_settings(USE_TZ=True)
+    def test_insert_datetime_offset(self):
+        for method in INSERT_METHODS:
+            insert_many(TestModelEvent, [("2016-01-01T10:00:00+02:00", 1)],
+                        columns=['moment', 'c'], method=method)
+            self.assertEqual(
+                datetime.datetime(2016, 1, 1, 8, 0, tzinfo=utc),
+                TestModelEvent.objects.get().moment)
+            TestModelEvent.objects.all().delete()
+
+    def test_insert_or_update_rows(self):
+        insert_many(TestModelA, [TestModelA(a="Test1", b=1, c=1)])
+        TestModelUnique(a="Test1", b=1, c=1).save()
+        rows = [{'a': "Test1", 'b': 1, 'c': 2}, {'a': "Test2", 'b': 2, 'c': 3}]
+        for method in ('select', 'on_conflict', 'staging'):
+            model = TestModelA if method == 'select' else TestModelUnique
+            inserted, updated = insert_or_update_many(
+                model, rows, keys=['a', 'b'], columns=['a', 'b', 'c'],
+                method=method)
+            self.assertEqual(2, model.objects.get(a="Test1").c)
+            self.assertEqual(3, model.objects.get(a="Test2").c)
+            self.assertIn({'c': 2, 'a': "Test1", 'b': 1}, updated)
+
+        # Only the columns are updated
+        insert_or_update_many(TestModelA, [("Test1", 5)], keys=['a'],
+                              columns=['a', 'c'])
+        self.assertEqual(1, TestModelA.objects.get(a="Test1").b)
+        self.assertEqual(5, TestModelA.objects.get(a="Test1").c)
+
+        update_many(TestModelA, [(4, "Test2")], keys=['a'],
+                    columns=['c', 'a'])
+        self.assertEqual(4, TestModelA.objects.get(a="Test2").c)
+
+    @requires_field_types
+    def test_insert_or_update_parsed_keys(self):
+        key = uuid.UUID("12345678-1234-5678-1234-567812345678")
+        TestModelTypes(day=datetime.date(2016, 2, 29),
+                       moment=datetime.datetime(2016, 2, 29, 12, 30),
+                       uuid=key, number=1).save()
+        for keys, row in ((['day'], ("2016-02-29", 2)),
+                          (['moment'], ("2016-02-29 12:30", 3)),
+                          (['uuid'], (str(key), 4))):
+            self.assertEqual((0, 1), insert_or_update_many(
+                TestModelTypes, [row], keys=keys, columns=keys + ['number'],
+                result='counts'))
+            self.assertEqual(row[1], TestModelTypes.objects.get().number)
+
+    def test_invalid_columns(self):
+        self.assertRaises(ValueError, insert_many, TestModelA, [("Test",)],
+                          columns=['d'])
+        self.assertRaises(ValueError, insert_many, TestModelA,
+                          [("Test", "Test")], columns=['a', 'a'])
+        self.assertRaises(ValueError, insert_or_update_many, TestModelA,
+                          [(1,)], keys=['a'], columns=['c'])
+        self.assertRaises(ValueError, update_many, TestModelA, [(1, 1)],
+                          keys=['b'], columns=['b', 'c'], only_dirty=True)
+
+
+class DeleteTest(TestCase):
+    def setUp(self):
+        insert_many(TestModelA, [TestModelA(a="Test%d" % (i % 3), b=i, c=i)
+                                 for i in range(9)])
+
+    def test_delete_objects(self):
+        objects = list(TestModelA.objects.filter(b__lt=4))
+        self.assertEqual(4, delete_many(TestModelA, objects, batch_size=3))
+        self.assertEqual(5, TestModelA.objects.count())
+        self.assertEqual(0, delete_many(TestModelA, objects))
+        self.assertEqual(0, delete_many(TestModelA, []))
+
+        pks = TestModelA.objects.filter(b__lt=6).values_list('pk', flat=True)
+        self.assertEqual(2, delete_many(TestModelA, iter(pks)))
+        self.assertEqual(3, TestModelA.objects.count())
+
+    def test_delete_key_tuples(self):
+        keys = [(4, "Test1"), (5, "Test2"), (5, "Test2"), (5, "Test0")]
+        self.assertEqual(2, delete_many(TestModelA, keys, keys=['b', 'a']))
+        self.assertEqual(7, TestModelA.objects.count())
+
+        deleted = delete_many(TestModelA, [{'a': "Test0", 'b': 3},
+                                           {'a': "Test0", 'b': 4}],
+                              keys=['a', 'b'], result='tuples')
+        self.assertEqual((('a', 'b'), [("Test0", 3)]), deleted)
+
+        keys = TestModelA.objects.values_list('a', 'b')
+        with Tracer() as tracer:
+            deleted = delete_many(TestModelA, keys, keys=['a', 'b'],
+                                  result='dicts', batch_size=4)
+        self.assertEqual(6, len(deleted))
+        self.assertIn({'a': "Test2", 'b': 8}, deleted)
+        self.assertEqual(0, TestModelA.objects.count())
+        summary = tracer.summary()
+        self.assertEqual(2, summary['delete']['count'])
+        self.assertEqual(2, summary['call']['statements'])
+
+    def test_delete_key_too_long(self):
+        TestModelA.objects.create(a="x" * 200, b=0, c=0)
+        self.assertEqual(0, delete_many(TestModelA, ["x" * 250],
+                                        keys=['a']))
+        self.assertEqual(10, TestModelA.objects.count())
+
+    def test_delete_invalid(self):
+        self.assertRaises(ValueError, delete_many, TestModelA, [1],
+                          keys=[])
+        self.assertRaises(ValueError, delete_many, TestModelA, [1],
+                          result='rows')
+        self.assertRaises(ValueError, delete_many, TestModelA, [1],
+                          batch_size=0)
+
+
+class SyncTest(TestCase):
+    def setUp(self):
+        insert_many(TestModelA, [TestModelA(a="Test%d" % (i % 2), b=i, c=i)
+                                 for i in range(6)])
+
+    def test_sync_scope(self):
+        objects = [TestModelA(a="Test0", b=0, c=10),
+                   TestModelA(a="Test0", b=6, c=6),
+                   TestModelA(a="Test1", b=1, c=11)]
+        for method in ('select', 'staging'):
+            with Tracer() as tracer:
+                counts = sync_many(TestModelA, iter(objects),
+                                   keys=['a', 'b'], scope={'a': "Test0"},
+                                   method=method, batch_size=2)
+            if method == 'select':
+                self.assertEqual((1, 2, 2), counts)
+            else:
+                self.assertEqual((0, 3, 0), counts)
+            # Test0 rows 2 and 4 are gone, the other Test1 rows are kept
+            self.assertEqual([0, 1, 3, 5, 6], sorted(
+                TestModelA.objects.values_list('b', flat=True)))
+            self.assertEqual(10, TestModelA.objects.get(b=0).c)
+            self.assertEqual(1, tracer.summary()['delete']['statements'])
+
+    def test_sync_keys_prepared_once(self):
+        calls = []
+        plan = get_write_plan(TestModelA, keys=['a', 'b'])
+        prepare_keys = plan.prepare_keys
+        plan.prepare_keys = lambda o, con: calls.append(o) or \
+            prepare_keys(o, con)
+        try:
+            sync_many(TestModelA, [TestModelA(a="Test0", b=i, c=1)
+                                   for i in range(3)], keys=['a', 'b'])
+        finally:
+            plan.prepare_keys = prepare_keys
+        self.assertEqual(3, len(calls))
+        self.assertEqual(3, TestModelA.objects.count())
+
+    def test_sync_null_keys(self):
+        objects = [TestModelTypes(text=None, number=1),
+                   TestModelTypes(text="Test", number=2)]
+        self.assertEqual((2, 0, 0), sync_many(TestModelTypes, objects,
+                                              keys=['text']))
+        self.assertEqual(2, TestModelTypes.objects.count())
+
+    def test_sync_rows(self):
+        rows = [("Test1", 1, 1), ("Test1", 3, 4)]
+        counts = sync_many(TestModelA, rows, keys=['a', 'b'],
+                           scope={'b__gte': 1}, columns=['a', 'b', 'c'],
+                           skip_unchanged=True)
+        self.assertEqual((0, 1, 1, 3), counts)
+        self.assertEqual([0, 1, 3], sorted(
+            TestModelA.objects.values_list('b', flat=True)))
+
+        self.assertEqual((0, 0, 0), sync_many(
+            TestModelA, [], keys=['a', 'b'], scope={'b__in': []}))
+        self.assertEqual((0, 0, 3), sync_many(TestModelA, [],
+                                              keys=['a', 'b']))
+        self.assertEqual(0, TestModelA.objects.count())
+
+
+class ImportTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt') as f:
+            f.write(text)
+        return path
+
+    def test_import_csv(self):
+        path = self.write('rows.csv', "name,b,c,other\nTest1,1,2,x\n"
+                                      "Test2,2,3,y\n")
+        self.assertEqual((2, 0), bulk_import(
+            TestModelA, path, columns={'name': 'a', 'b': 'b', 'c': 'c'},
+            batch_size=1))
+        self.assertEqual(2, TestModelA.objects.get(a="Test1").c)
+
+        path = self.write('rows.csv.gz', "a,b,c\nTest1,1,5\nTest3,3,4\n"
+                                         "Test3,3,6\n")
+        self.assertEqual((1, 1), bulk_import(TestModelA, path,
+                                             keys=['a', 'b']))
+        self.assertEqual(5, TestModelA.objects.get(a="Test1").c)
+        self.assertEqual(6, TestModelA.objects.get(a="Test3").c)
+
+    def test_import_csv_empty_values(self):
+        path = self.write('types.csv', "text,number,day\n,,2016-02-29\n")
+        bulk_import(TestModelTypes, path)
+        n = TestModelTypes.objects.get()
+        self.assertEqual(None, n.text)
+        self.assertEqual(None, n.number)
+        self.assertEqual(datetime.date(2016, 2, 29), n.day)
+
+        path = self.write('rows.csv', "a,b,c\n,1,2\n")
+        bulk_import(TestModelA, path)
+        self.assertEqual("", TestModelA.objects.get().a)
+
+    def test_import_jsonl(self):
+        lines = StringIO(u'{"a": "Test1", "b": 1, "c": 2}\n\n'
+                         u'{"a": "Test2", "b": 2, "c": 3}\n')
+        self.assertEqual((2, 0), bulk_import(TestModelA, lines,
+                                             format='jsonl'))
+        path = self.write('rows.jsonl', '{"a": "Test2", "b": 2, "c": 4}\n')
+        self.assertEqual((0, 1), bulk_import(TestModelA, path,
+                                             keys=['a', 'b'],
+                                             method='staging'))
+        self.assertEqual(4, TestModelA.objects.get(a="Test2").c)
+        self.assertEqual((0, 0), bulk_import(
+            TestModelA, self.write('empty.jsonl', '')))
+
+    def test_import_errors(self):
+        path = self.write('rows.txt', "a,b,c\n")
+        self.assertRaises(ValueError, bulk_import, TestModelA, path)
+        path = self.write('rows.csv', "a,b,c\nTest,1\n")
+        self.assertRaises(ValueError, bulk_import, TestModelA, path)
+        self.assertRaises(ValueError, bulk_import, TestModelA, path,
+                          columns=['a', 'd'])
+
+    @requires_argparse_commands
+    def test_bulk_import_command(self):
+        path = self.write('rows.csv', "name;b;c\n\nTest1;1;2\n\n")
+        out = StringIO()
+        call_command('bulk_import', 'bulktest.TestModelA', path,
+                     maps=['name=a', 'b', 'c'], keys='a', delimiter=';',
+                     stdout=out)
+        self.assertEqual("Inserted 1 and updated 0 rows of "
+                         "bulktest.TestModelA.", out.getvalue().strip())
+        self.assertEqual(1, TestModelA.objects.get(a="Test1").b)
+        self.assertRaises(CommandError, call_command, 'bulk_import',
+                          'bulktest.Unknown', path)
+
+        # Invalid values are reported, not raised as a traceback
+        path = self.write('types.csv', "flag\nmaybe\n")
+        self.assertRaises(CommandError, call_command, 'bulk_import',
+                          'bulktest.TestModelTypes', path, stdout=out)
+
+
+class StreamingTest(TestCase):
+    def generate(self, n, c=1, seen=None):
+        for i in range(n):
+            if seen is not None:
+                seen.append(TestModelA.objects.count())
+            yield TestModelA(a="Test", b=i, c=c)
+
+    def test_insert_generator(self):
+        seen = []
+        insert_many(TestModelA, self.generate(10, seen=seen), batch_size=4)
+        self.assertEqual(10, TestModelA.objects.all().count())
+        # Each batch is written before the next one is consumed
+        self.assertEqual([0, 0, 0, 0, 4, 4, 4, 4, 8, 8], seen)
+
+    def test_insert_generator_no_batch(self):
+        for method in INSERT_METHODS:
+            insert_many(TestModelA, self.generate(5), method=method)
+        self.assertEqual(15, TestModelA.objects.all().count())
+
+    def test_update_generator(self):
+        insert_many(TestModelA, self.generate(10))
+        update_many(TestModelA, self.generate(10, c=2), keys=['b'],
+                    batch_size=3)
+        self.assertEqual(10, TestModelA.objects.filter(c=2).count())
+
+    def test_insert_update_generator(self):
+        insert_many(TestModelA, self.generate(5))
+        inserted, updated = insert_or_update_many(
+            TestModelA, self.generate(10, c=2), keys=['b'], batch_size=3)
+        self.assertEqual(10, TestModelA.objects.filter(c=2).count())
+        self.assertEqual(5, len(inserted))
+        self.assertEqual(5, len(updated))
+
+    def test_insert_update_empty_generator(self):
+        for method in ('select', 'on_conflict', 'staging'):
+            self.assertEqual(([], []), insert_or_update_many(
+                TestModelUnique, self.generate(0), keys=['a', 'b'],
+                method=method))
+
+
+class WritePlanTest(TestCase):
+    def tearDown(self):
+        clear_write_plans()
+
+    def test_plan_cached(self):
+        plan = get_write_plan(TestModelA, keys=['a', 'b'])
+        self.assertTrue(plan is get_write_plan(TestModelA, keys=('b', 'a')))
+        self.assertFalse(plan is get_write_plan(TestModelA, keys=['a']))
+        self.assertFalse(plan is get_write_plan(TestModelA, keys=['a', 'b'],
+                                                exclude_fields=['c']))
+
+    def test_plan_fields(self):
+        plan = get_write_plan(TestModelA, keys=['a'], update_fields=['b'])
+        self.assertEqual(['a', 'b', 'c'], [f.name for f in plan.fields])
+        self.assertEqual(['a'], [f.name for f in plan.key_fields])
+        self.assertEqual(['b'], [f.name for f in plan.value_fields])
+        self.assertEqual([0], plan.key_index)
+        self.assertEqual([1, 0], plan.param_index)
+
+    def test_plan_statement(self):
+        plan = get_write_plan(TestModelA)
+        sql = plan.statement('insert', 2)
+        self.assertTrue(sql.endswith("VALUES (%s,%s,%s),(%s,%s,%s)"))
+        self.assertTrue(sql is plan.statement('insert', 2))
+
+    @requires_field_types
+    def test_plan_prepare(self):
+        plan = get_write_plan(TestModelTypes)
+        moment = datetime.datetime(2016, 2, 29, 12, 30, tzinfo=utc)
+        n = TestModelTypes(text="Test", number=3, moment=moment)
+
+        values = dict(zip([f.name for f in plan.fields],
+                          plan.prepare_insert(n, connection)))
+        self.assertEqual("Test", values['text'])
+        self.assertEqual(3, values['number'])
+        self.assertEqual(moment.replace(tzinfo=None), values['moment'])
+        self.assertEqual(None, values['uuid'])
+
+    def test_row_plan_prepared_columns(self):
+        plan = get_write_plan(TestModelA)
+        row = ("Test", "1", "2")
+        self.assertEqual(("Test", 1, 2), tuple(
+            plan.row_plan(['a', 'b', 'c']).prepare_insert(row, connection)))
+        # Sent as they are
+        self.assertEqual(("Test", "1", 2), tuple(
+            plan.row_plan(['a', 'b', 'c'], prepared=['b']).prepare_insert(
+                row, connection)))
+        self.assertRaises(ValueError, plan.row_plan, ['a', 'b'],
+                          prepared=['c'])
+
+        # auto_now_add still applies
+        plan = get_write_plan(TestModelAutoCreated)
+        values = plan.row_plan(['a', 'b', 'created'],
+                               prepared=['created']).prepare_insert(
+            ("Test", 1, None), connection)
+        self.assertTrue(values[-1])
+
+    def test_clear_write_plans(self):
+        plan = get_write_plan(TestModelA)
+        clear_write_plans()
+        self.assertFalse(plan is get_write_plan(TestModelA))
+
+
+@requires_from_db
+class DirtyFieldsTest(TestCase):
+    def setUp(self):
+        for i in range(3):
+            TestModelDirty(a="Test%d" % i, b=i, c=i).save()
+
+    def test_dirty_fields(self):
+        n = TestModelDirty.objects.get(a="Test0")
+        self.assertEqual(set(), n.get_dirty_fields())
+        n.b = 5
+        self.assertEqual(set(['b']), n.get_dirty_fields())
+        n.mark_clean()
+        self.assertEqual(set(), n.get_dirty_fields())
+        self.assertEqual(None, TestModelDirty(a="New").get_dirty_fields())
+
+    def test_deferred_dirty_fields(self):
+        n = TestModelDirty.objects.only('a').get(a="Test0")
+        self.assertEqual(set(), n.get_dirty_fields())
+        n.c = 5
+        self.assertEqual(set(['c']), n.get_dirty_fields())
+
+    def test_update_only_dirty(self):
+        n0, n1, n2 = TestModelDirty.objects.order_by('b')
+        n0.b = 10
+        n1.c = 11
+        n1.b = 11
+
+        # Concurrent changes to columns that were not changed locally
+        TestModelDirty.objects.update(c=F('c') + 100)
+
+        self.assertEqual((2, 1), update_many(
+            TestModelDirty, [n0, n1, n2], only_dirty=True,
+            skip_unchanged=True))
+        self.assertEqual(set(), n0.get_dirty_fields())
+        self.assertEqual(set(), n1.get_dirty_fields())
+
+        self.assertEqual((10, 100), TestModelDirty.objects.filter(
+            a="Test0").values_list('b', 'c').get())
+        self.assertEqual((11, 11), TestModelDirty.objects.filter(
+            a="Test1").values_list('b', 'c').get())
+        self.assertEqual((2, 102), TestModelDirty.objects.filter(
+            a="Test2").values_list('b', 'c').get())
+
+    def test_update_only_dirty_savepoints(self):
+        objects = list(TestModelDirty.objects.all())
+        for n in objects:
+            n.c += 1
+        with CaptureQueriesContext(connection) as queries:
+            update_many(TestModelDirty, objects, only_dirty=True,
+                        batch_size=1)
+        # Only the savepoint of update_many itself
+        self.assertEqual(1, len([q for q in queries.captured_queries
+                                 if q['sql'].startswith('SAVEPOINT')]))
+
+    def test_update_only_dirty_untracked(self):
+        n = TestModelA(a="Test", b=1, c=1)
+        n.save()
+        n.b = n.c = 2
+        update_many(TestModelA, [n], only_dirty=True)
+        self.assertEqual(2, TestModelA.objects.get().c)
+
+
+class ParallelTest(TransactionTestCase):
+    def test_parallel_result_formats(self):
+        set1 = [TestModelA(a="Test", b=i, c=1) for i in range(10)]
+        self.assertEqual((10, 0), parallel_insert_or_update_many(
+            TestModelA, set1, keys=['b'], workers=12, result='counts'))
+
+        header, rows = parallel_insert_or_update_many(
+            TestModelA, set1, keys=['b'], workers=3, result='tuples')[1]
+        self.assertEqual(('a', 'c', 'b'), header)
+        self.assertEqual(list(range(10)), sorted(r[2] for r in rows))
+
+    def test_parallel_insert_update(self):
+        insert_many(TestModelA, [TestModelA(a="Test", b=i, c=1)
+                                 for i in range(50)])
+
+        set2 = [TestModelA(a="Test", b=i, c=2) for i in range(25, 100)]
+        set2.append(TestModelA(a="Test", b=30, c=3))
+        inserted, updated = parallel_insert_or_update_many(
+            TestModelA, set2, keys=['b'], workers=3)
+        self.assertEqual(50, len(inserted))
+        self.assertEqual(26, len(updated))
+        self.assertEqual(100, TestModelA.objects.count())
+        self.assertEqual(3, TestModelA.objects.get(b=30).c)
+        self.assertEqual(74, TestModelA.objects.filter(c=2).count())
+
+    def test_parallel_partial_failure(self):
+        set1 = [TestModelA(a="Test", b=i, c=1) for i in range(20)]
+        set1[5].c = None
+        try:
+            parallel_insert_or_update_many(TestModelA, set1, keys=['b'],
+                                           workers=4)
+        except ParallelWriteError as e:
+            self.assertEqual(1, len(e.errors))
+            failed = list(e.errors)[0]
+            self.assertEqual(None, e.results[failed])
+            self.assertEqual(sum(len(r[0]) for r in e.results if r),
+                             TestModelA.objects.count())
+        else:
+            self.fail("ParallelWriteError not raised")
+
+
+@override_settings(DJANGOBULK_PREPARED_STATEMENTS=2)
+class PreparedStatementTest(TestCase):
+    def tearDown(self):
+        clear_prepared_statements()
+
+    def prepared(self):
+        cursor = connection.cursor()
+        cursor.execute("SELECT name FROM pg_prepared_statements "
+                       "WHERE name LIKE 'djangobulk_%%'")
+        return len(cursor.fetchall())
+
+    def test_prepared_insert_update(self):
+        for i in range(3):
+            insert_many(TestModelA, [TestModelA(a="Test", b=i, c=1)])
+        self.assertEqual(1, self.prepared())
+
+        insert_or_update_many(TestModelA, [TestModelA(a="Test", b=1, c=2),
+                                           TestModelA(a="Test", b=5, c=2)],
+                              keys=['b'])
+        self.assertEqual(2, self.prepared())
+        self.assertEqual(4, TestModelA.objects.count())
+        self.assertEqual(2, TestModelA.objects.filter(c=2).count())
+
+        update_many(TestModelA, list(TestModelA.objects.all()),
+                    method='executemany')
+        self.assertEqual(2, self.prepared())
+
+    def test_clear(self):
+        insert_many(TestModelA, [TestModelA(a="Test", b=1, c=1)])
+        self.assertEqual(1, self.prepared())
+        clear_prepared_statements()
+        self.assertEqual(0, self.prepared())
+        insert_many(TestModelA, [TestModelA(a="Test", b=2, c=1)])
+        self.assertEqual(2, TestModelA.objects.count())
+
+
+class TracingTest(TestCase):
+    def test_trace_staging(self):
+        with Tracer() as tracer:
+            insert_or_update_many(TestModelUnique,
+                                  [TestModelUnique(a="Test", b=1, c=1)],
+                                  keys=['a', 'b'], method='staging')
+        summary = tracer.summary()
+        self.assertEqual(3, summary['copy']['statements'])
+        self.assertEqual(1, summary['insert']['rows'])
+        self.assertEqual(6, summary['call']['statements'])
+
+    def test_trace_insert_or_update(self):
+        insert_many(TestModelA, [TestModelA(a="Test", b=i, c=1)
+                                 for i in range(5)])
+
+        set2 = [TestModelA(a="Test", b=i, c=2) for i in range(3, 10)]
+        with Tracer() as tracer:
+            insert_or_update_many(TestModelA, set2, keys=['b'], batch_size=4)
+
+        names = [p.name for p in tracer.phases]
+        self.assertEqual(['prepare', 'select', 'prepare', 'update', 'filter',
+                          'prepare', 'insert'], names[:7])
+        self.assertEqual('call', names[-1])
+
+        call = tracer.phases[-1]
+        self.assertEqual('insert_or_update_many', call.operation)
+        self.assertEqual(TestModelA, call.model)
+        self.assertEqual(7, call.rows)
+        self.assertEqual(set([0, 1]),
+                         set(p.batch for p in tracer.phases[:-1]))
+
+        summary = tracer.summary()
+        self.assertEqual(2, summary['update']['rows'])
+        self.assertEqual(5, summary['insert']['rows'])
+        self.assertEqual(2, summary['select']['statements'])
+        self.assertEqual(call.statements,
+                         sum(t['statements'] for name, t in summary.items()
+                             if name != 'call'))
+        self.assertTrue(call.bytes > 0)
+        self.assertTrue(call.elapsed >= summary['insert']['elapsed'])
+
+    def test_trace_copy(self):
+        with Tracer() as tracer:
+            insert_many(TestModelA, (TestModelA(a="Test", b=i, c=1)
+                                     for i in range(5)), method='copy')
+        insert, call = tracer.phases
+        self.assertEqual(5, insert.rows)
+        self.assertEqual(1, insert.statements)
+        self.assertEqual(len("Test\t0\t1\n") * 5, insert.bytes)
+
+    def test_listener(self):
+        phases = []
+        add_listener(phases.append)
+        try:
+            update_many(TestModelA, [TestModelA(a="Test", b=1, c=1)])
+        finally:
+            remove_listener(phases.append)
+        insert_many(TestModelA, [TestModelA(a="Test", b=1, c=1)])
+        self.assertEqual(['prepare', 'update', 'call'],
+                         [p.name for p in phases])
+
+
+class BenchCommandTest(TestCase):
+    @requires_argparse_commands
+    def test_bulkbench(self):
+        out = StringIO()
+        call_command('bulkbench', rows=30, columns=3,
+                     types='int,text,datetime', key_width=2, duplicates=0.2,
+                     batch_sizes='0,7', stdout=out)
+        lines = out.getvalue().splitlines()
+        # Header, then every method of each operation for each batch size
+        self.assertEqual(1 + 2 * (3 + 2 + 3), len(lines))
+        self.assertEqual(['insert', 'values', '7', '30'],
+                         lines[4].split()[:4])
+        self.assertTrue(all(int(line.split()[6]) > 0 for line in lines[1:]))
+
+    @requires_argparse_commands
+    def test_bulkbench_untraced(self):
+        out = StringIO()
+        call_command('bulkbench', rows=10, operations='insert',
+                     batch_sizes='0', statements=False, memory=False,
+                     stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(1 + 3, len(lines))
+        self.assertTrue(all(line.split()[6:] == ['-', '-']
+                            for line in lines[1:]))
+
 
 class TestPreSave(TestCase):
     """Test the presave() method support."""
@@ -328,3 +1468,9 @@ class TestPreSave(TestCase):
         m.a = 3
         insert_many(TestModelPreSave, [m])
         self.assertEquals(m.a, 5)
+
+    def test_field_pre_save_called(self):
+        # A date field subclass overriding pre_save
+        insert_many(TestModelStamped, [TestModelStamped(a=1)])
+        self.assertEqual(StampField.STAMP,
+                         TestModelStamped.objects.get().stamp)
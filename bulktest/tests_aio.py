@@ -0,0 +1,99 @@
+import datetime
+import unittest
+
+from django.db import connection
+from django.test import TransactionTestCase
+from bulktest.models import (TestModelA, TestModelEvent, TestModelTypes,
+                             TestModelUnique)
+
+try:
+    import psycopg
+    from djangobulk.aio import (ainsert_many, aupdate_many,
+                                ainsert_or_update_many)
+    from bulktest.aio_calls import call, call_concurrently
+except ImportError:
+    psycopg = None
+
+
+@unittest.skipIf(psycopg is None, "psycopg 3 is not installed")
+class AsyncTest(TransactionTestCase):
+    def connect(self):
+        params = connection.get_connection_params()
+        params['dbname'] = params.pop('database')
+        params = dict((k, v) for k, v in params.items() if v)
+        return psycopg.AsyncConnection.connect(**params)
+
+    def call(self, func, *args, **kwargs):
+        return call(self.connect, func, *args, **kwargs)
+
+    def test_insert(self):
+        for method in ('values', 'executemany', 'copy'):
+            set1 = [TestModelA(a=method, b=i, c=1) for i in range(5)]
+            entries = self.call(ainsert_many, TestModelA, set1,
+                                method=method, skip_result=False)
+            self.assertEqual(5, len(entries))
+            self.assertEqual(5, TestModelA.objects.filter(a=method).count())
+
+    def test_insert_field_types(self):
+        n = TestModelTypes(text="Test", data=b"\x00binary")
+        self.call(ainsert_many, TestModelTypes, [n])
+        self.assertEqual(n.data, bytes(TestModelTypes.objects.get().data))
+
+    def test_update(self):
+        TestModelA(a="Test", b=1, c=1).save()
+        set1 = [TestModelA(a="Test", b=2, c=2)]
+        self.call(aupdate_many, TestModelA, set1, keys=['a'])
+        self.assertEqual(2, TestModelA.objects.get().c)
+
+    def test_insert_update(self):
+        TestModelA(a="Test1", b=1, c=1).save()
+        set1 = [
+            TestModelA(a="Test1", b=1, c=2),
+            TestModelA(a="Test2", b=2, c=2),
+            TestModelA(a="Test2", b=2, c=3),
+        ]
+        inserted, updated = self.call(ainsert_or_update_many, TestModelA,
+                                      set1, keys=['a'], batch_size=2)
+        self.assertEqual(2, TestModelA.objects.count())
+        self.assertEqual(2, TestModelA.objects.get(a="Test1").c)
+        self.assertEqual(3, TestModelA.objects.get(a="Test2").c)
+
+    def test_insert_update_on_conflict(self):
+        TestModelUnique(a="Test1", b=1, c=1).save()
+        set1 = [
+            TestModelUnique(a="Test1", b=1, c=2),
+            TestModelUnique(a="Test2", b=2, c=2),
+        ]
+        inserted, updated = self.call(ainsert_or_update_many,
+                                      TestModelUnique, set1,
+                                      keys=['a', 'b'], method='on_conflict')
+        self.assertEqual(1, len(inserted))
+        self.assertEqual(1, len(updated))
+        self.assertEqual(2, TestModelUnique.objects.get(a="Test1").c)
+
+    def test_insert_update_datetime_key(self):
+        moment = datetime.datetime(2016, 2, 29, 12, 30)
+        # Written in the session time zone of psycopg, not Django's
+        self.call(ainsert_many, TestModelEvent,
+                  [TestModelEvent(moment=moment, c=1)])
+        for c, method in enumerate(('select', 'on_conflict'), 2):
+            inserted, updated = self.call(
+                ainsert_or_update_many, TestModelEvent,
+                [TestModelEvent(moment=moment, c=c)], keys=['moment'],
+                method=method)
+            self.assertEqual((0, 1), (len(inserted), len(updated)))
+            self.assertEqual(c, TestModelEvent.objects.get().c)
+
+    def test_insert_update_empty_iterator(self):
+        for method in ('select', 'on_conflict'):
+            self.assertEqual(([], []), self.call(
+                ainsert_or_update_many, TestModelUnique, iter([]),
+                keys=['a', 'b'], method=method))
+
+    def test_concurrent_inserts(self):
+        calls = []
+        for i in range(4):
+            set1 = [TestModelA(a="Test%d" % i, b=j, c=1) for j in range(10)]
+            calls.append((ainsert_many, (TestModelA, set1), {}))
+        call_concurrently(self.connect, calls)
+        self.assertEqual(40, TestModelA.objects.count())
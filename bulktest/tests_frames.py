@@ -0,0 +1,105 @@
+import datetime
+import decimal
+import unittest
+import uuid
+
+from django.db import models
+from django.test import TestCase
+from bulktest.models import TestModelA, TestModelTypes, TestModelUnique
+
+try:
+    import numpy as np
+    import pandas as pd
+    from djangobulk.frames import (insert_many_frame,
+                                   insert_or_update_many_frame, _frame_rows)
+except ImportError:
+    pd = None
+
+# TestModelTypes has UUID, duration and binary fields on Django >= 1.8
+requires_field_types = unittest.skipUnless(
+    hasattr(models, 'UUIDField'), "Django < 1.8 has no UUIDField")
+
+
+@unittest.skipIf(pd is None, "pandas is not installed")
+class FrameTest(TestCase):
+    def test_insert_frame(self):
+        frame = pd.DataFrame({'a': ["Test"] * 5, 'b': np.arange(5),
+                              'c': np.ones(5, dtype='int64')})
+        for method in ('values', 'executemany', 'copy'):
+            self.assertEqual(5, insert_many_frame(TestModelA, frame,
+                                                  method=method))
+        self.assertEqual(15, TestModelA.objects.count())
+        self.assertEqual(list(range(5)), sorted(set(
+            TestModelA.objects.values_list('b', flat=True))))
+
+    @requires_field_types
+    def test_insert_frame_types(self):
+        key = uuid.UUID("12345678-1234-5678-1234-567812345678")
+        frame = pd.DataFrame({
+            'number': pd.array([1, None], dtype="Int64"),
+            'moment': pd.to_datetime(["2016-02-29 12:30", None]),
+            'day': pd.to_datetime(["2016-02-29", None]),
+            'decimal': [1.5, np.nan],
+            'key': [key, None],
+            'duration': pd.to_timedelta(["1 hour", None]),
+        })
+        for method in ('values', 'copy'):
+            insert_many_frame(TestModelTypes, frame, method=method,
+                              columns={'number': 'number',
+                                       'moment': 'moment', 'day': 'day',
+                                       'decimal': 'decimal', 'key': 'uuid',
+                                       'duration': 'duration'})
+            n = TestModelTypes.objects.get(number=1)
+            self.assertEqual(datetime.datetime(2016, 2, 29, 12, 30),
+                             n.moment)
+            self.assertEqual(datetime.date(2016, 2, 29), n.day)
+            self.assertEqual(decimal.Decimal("1.5"), n.decimal)
+            self.assertEqual(key, n.uuid)
+            self.assertEqual(datetime.timedelta(hours=1), n.duration)
+
+            n = TestModelTypes.objects.get(number=None)
+            self.assertEqual((None, None, None, None, None),
+                             (n.moment, n.day, n.decimal, n.uuid,
+                              n.duration))
+            TestModelTypes.objects.all().delete()
+
+    def test_insert_or_update_frame(self):
+        TestModelUnique(a="Test1", b=1, c=1).save()
+        frame = pd.DataFrame({'name': ["Test1", "Test2"], 'b': [1, 2],
+                              'c': [2, 3]})
+        for method in ('select', 'on_conflict', 'staging'):
+            TestModelUnique.objects.filter(a="Test2").delete()
+            inserted, updated = insert_or_update_many_frame(
+                TestModelUnique, frame, keys=['a', 'b'], method=method,
+                columns={'name': 'a', 'b': 'b', 'c': 'c'})
+            self.assertEqual((1, 1), (inserted, updated))
+            self.assertEqual(2, TestModelUnique.objects.get(a="Test1").c)
+
+    @requires_field_types
+    def test_insert_or_update_frame_uuid(self):
+        key = uuid.UUID("12345678-1234-5678-1234-567812345678")
+        TestModelTypes(uuid=key, number=1).save()
+        for keys in ([key], [str(key)]):
+            frame = pd.DataFrame({'uuid': keys, 'number': [2]})
+            self.assertEqual((0, 1), insert_or_update_many_frame(
+                TestModelTypes, frame, keys=['uuid']))
+            self.assertEqual(2, TestModelTypes.objects.get().number)
+            TestModelTypes.objects.update(number=1)
+
+    def test_prepared_columns(self):
+        frame = pd.DataFrame({
+            'a': ["Test"], 'b': np.arange(1), 'c': [1.5],
+            'moment': pd.to_datetime(["2016-02-29 12:30"])})
+        names, prepared, rows = _frame_rows(TestModelTypes, frame, {
+            'a': 'text', 'b': 'number', 'c': 'decimal', 'moment': 'moment'})
+        # Only the converted columns of a matching type are sent as they are
+        self.assertEqual(['number', 'moment'], prepared)
+
+    def test_insert_array(self):
+        array = np.array([[1, 2], [3, 4]])
+        insert_many_frame(TestModelA, array, columns=['b', 'c'])
+        self.assertEqual([(1, 2), (3, 4)], sorted(
+            TestModelA.objects.values_list('b', 'c')))
+        self.assertRaises(ValueError, insert_many_frame, TestModelA, array)
+        self.assertRaises(ValueError, insert_many_frame, TestModelA, array,
+                          columns=['b', 'd'])
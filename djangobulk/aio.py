@@ -0,0 +1,323 @@
+'''
+Asynchronous bulk operations on psycopg 3.
+
+The functions mirror those of `djangobulk.bulk` but run on a psycopg 3
+`AsyncConnection`, or on a connection taken from an `AsyncConnectionPool`,
+so that batches from many coroutines can be in flight concurrently
+without tying up threads. The Django database `using` only provides the
+model's SQL and value preparation, and is never connected to.
+
+Requires PostgreSQL and psycopg 3: pip install django-bulk-compat[async]
+
+'''
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import psycopg
+from psycopg.types.json import Jsonb
+from django.db import connections
+
+from djangobulk.bulk import (
+    INSERT_METHODS, UPDATE_METHODS, get_write_plan, _batches, _build_rows,
+    _copy_line, _key, _object_batches, _statement_rows,
+)
+
+ASYNC_UPSERT_METHODS = ('select', 'on_conflict')
+
+# Fields for which Django returns psycopg2 adapters psycopg 3 can't handle
+_WRAPPED_TYPES = ('BinaryField', 'JSONField')
+
+
+def _unwrap(value):
+    """Convert a psycopg2 adapter into a value psycopg 3 can adapt."""
+    if not hasattr(value, 'adapted'):
+        return value
+    if hasattr(value, 'dumps'):
+        return Jsonb(value.adapted, dumps=value.dumps)
+    return value.adapted
+
+
+def _preparer(prepare, fields):
+    """Wrap a row preparer of `fields` to unwrap psycopg2 adapters."""
+    index = [i for i, f in enumerate(fields)
+             if f.get_internal_type() in _WRAPPED_TYPES]
+    if not index:
+        return prepare
+
+    def prepare_unwrapped(obj, con):
+        values = list(prepare(obj, con))
+        for i in index:
+            values[i] = _unwrap(values[i])
+        return tuple(values)
+
+    return prepare_unwrapped
+
+
+@asynccontextmanager
+async def _transaction(connection):
+    """Yield a cursor in a transaction on `connection` or a pooled one."""
+    if isinstance(connection, psycopg.AsyncConnection):
+        async with connection.transaction():
+            async with connection.cursor() as cursor:
+                yield cursor
+    else:
+        async with connection.connection() as conn:
+            async with conn.transaction():
+                async with conn.cursor() as cursor:
+                    yield cursor
+
+
+def _check_postgresql(con):
+    if con.vendor != 'postgresql':
+        raise ValueError("Asynchronous bulk operations require PostgreSQL")
+
+
+async def _ainsert_many(plan, cursor, objects, skip_result=True,
+                        method='values', rows_per_statement=None,
+                        max_parameters=None):
+    con = connections[plan.using]
+    fields = plan.fields
+    if method == 'copy':
+        # COPY renders the Django prepared values itself
+        prepare = plan.prepare_insert
+    else:
+        prepare = _preparer(plan.prepare_insert, fields)
+    parameters = (prepare(o, con) for o in objects)
+    if not skip_result:
+        parameters = list(parameters)
+
+    if method == 'executemany':
+        await cursor.executemany(plan.insert_sql, parameters)
+    elif method == 'copy':
+        async with cursor.copy(plan.copy_sql) as copy:
+            for p in parameters:
+                await copy.write(_copy_line(p))
+    else:
+        size = _statement_rows(len(fields), rows_per_statement,
+                               max_parameters)
+        for batch in _batches(parameters, size):
+            await cursor.execute(plan.statement('insert', len(batch)),
+                                 [v for p in batch for v in p])
+
+    if not skip_result:
+        return _build_rows(plan.fields, parameters)
+
+    return []
+
+
+async def ainsert_many(model, objects, connection, using="default",
+                       skip_result=True, method='values',
+                       rows_per_statement=None, max_parameters=None,
+                       batch_size=None):
+    '''
+    Asynchronously bulk insert Django objects, see
+    `djangobulk.bulk.insert_many`. All batches run in one transaction.
+
+    :param model: Django model class.
+    :param objects: Iterable of objects of class `model`.
+    :param connection: psycopg 3 `AsyncConnection` or `AsyncConnectionPool`.
+    :param using: Django database providing the SQL and value preparation.
+    :param method: 'values', 'executemany' or 'copy'.
+    :param rows_per_statement: Maximum rows per statement for the 'values'
+        method.
+    :param max_parameters: Maximum parameters per statement for the 'values'
+        method.
+    :param batch_size: Maximum objects prepared and sent per batch.
+    :raises ValueError: if method is unknown, batch_size is not positive or
+        `using` is not PostgreSQL.
+    '''
+    if method not in INSERT_METHODS:
+        raise ValueError("Unknown insert method: %r" % (method,))
+    _check_postgresql(connections[using])
+
+    plan = get_write_plan(model, using=using)
+
+    rows = []
+    async with _transaction(connection) as cursor:
+        for batch in _object_batches(objects, batch_size):
+            rows.extend(await _ainsert_many(
+                plan, cursor, batch, skip_result, method,
+                rows_per_statement, max_parameters))
+    return rows
+
+
+async def _aupdate_many(plan, cursor, objects, skip_result=True,
+                        method='values', rows_per_statement=None,
+                        max_parameters=None):
+    con = connections[plan.using]
+    param_fields = plan.param_fields
+    prepare = _preparer(plan.prepare_params, param_fields)
+    parameters = [prepare(o, con) for o in objects]
+
+    if method == 'executemany':
+        await cursor.executemany(plan.update_sql, parameters)
+    else:
+        # A row can only be updated once per statement: latest wins
+        num_keys = len(plan.key_fields)
+        rows = OrderedDict((p[-num_keys:], p) for p in parameters)
+
+        size = _statement_rows(len(param_fields), rows_per_statement,
+                               max_parameters)
+        for batch in _batches(rows.values(), size):
+            await cursor.execute(plan.statement('update', len(batch)),
+                                 [v for p in batch for v in p])
+
+    if not skip_result:
+        return _build_rows(param_fields, parameters)
+
+    return []
+
+
+async def aupdate_many(model, objects, connection, keys=None,
+                       using="default", update_fields=None,
+                       exclude_fields=None, method='values',
+                       rows_per_statement=None, max_parameters=None,
+                       batch_size=None):
+    '''
+    Asynchronously bulk update Django objects, see
+    `djangobulk.bulk.update_many`. All batches run in one transaction.
+
+    :param model: Django model class.
+    :param objects: Iterable of objects of class `model`.
+    :param connection: psycopg 3 `AsyncConnection` or `AsyncConnectionPool`.
+    :param keys: An iterable of field names to use in the WHERE clause on. If
+        none the model's primary key is used.
+    :param using: Django database providing the SQL and value preparation.
+    :param update_fields: An iterable of field names up be updated. If none
+        or empty, all fields of the model are updated.
+    :param exclude_fields: An iterable of field names to be excluded from
+        the set of model fields to be updated.
+    :param method: 'values' or 'executemany'.
+    :param rows_per_statement: Maximum rows per statement for the 'values'
+        method.
+    :param max_parameters: Maximum parameters per statement for the 'values'
+        method.
+    :param batch_size: Maximum objects prepared and sent per batch.
+    :raises ValueError: if method is unknown, batch_size is not positive or
+        `using` is not PostgreSQL.
+    '''
+    if method not in UPDATE_METHODS:
+        raise ValueError("Unknown update method: %r" % (method,))
+    _check_postgresql(connections[using])
+
+    plan = get_write_plan(model, keys, update_fields, exclude_fields, using)
+
+    async with _transaction(connection) as cursor:
+        for batch in _object_batches(objects, batch_size):
+            await _aupdate_many(plan, cursor, batch, method=method,
+                                rows_per_statement=rows_per_statement,
+                                max_parameters=max_parameters)
+
+
+async def _aupsert_many(plan, cursor, objects, skip_update=False):
+    """Bulk insert or update using INSERT ... ON CONFLICT."""
+    if plan.key_index is None:
+        raise ValueError("ON CONFLICT requires inserted key fields, "
+                         "not the auto primary key")
+
+    con = connections[plan.using]
+    fields = plan.fields
+    key_index = plan.key_index
+    prepare = _preparer(plan.prepare_insert, fields)
+
+    # Rows with duplicate keys cannot be in the same statement: latest wins
+    rows = OrderedDict()
+    for o in objects:
+        p = prepare(o, con)
+        rows[tuple(p[i] for i in key_index)] = p
+
+    kind = 'upsert_nothing' if skip_update else 'upsert'
+    param_index = plan.param_index
+    inserted, updated = [], []
+    size = _statement_rows(len(fields))
+    for batch in _batches(rows.values(), size):
+        await cursor.execute(plan.statement(kind, len(batch)),
+                             [v for p in batch for v in p])
+        for row in await cursor.fetchall():
+            p = rows[_key(row[:-1])]
+            if row[-1]:
+                inserted.append(p)
+            else:
+                updated.append(tuple(p[i] for i in param_index))
+
+    return (_build_rows(fields, inserted),
+            _build_rows(plan.param_fields, updated))
+
+
+async def _ainsert_or_update_many(plan, cursor, objects, skip_update=False):
+    """Bulk insert or update by first selecting the existing keys."""
+    con = connections[plan.using]
+    prepare_keys = _preparer(plan.prepare_keys, plan.key_fields)
+    object_keys = [(o, prepare_keys(o, con)) for o in objects]
+    if not object_keys:
+        # Also an exhausted iterator
+        return ([], [])
+
+    columns = zip(*(k for (_, k) in object_keys))
+    await cursor.execute(plan.select_keys_sql, [list(c) for c in columns])
+    existing = set(_key(row) for row in await cursor.fetchall())
+
+    updated_rows = []
+    if not skip_update:
+        update_objects = [o for (o, k) in object_keys if k in existing]
+        if update_objects:
+            updated_rows = await _aupdate_many(plan, cursor, update_objects,
+                                               skip_result=False)
+
+    # Insert the new objects, latest wins among duplicate keys
+    insert_objects = OrderedDict(
+        (k, o) for (o, k) in object_keys if k not in existing
+    )
+    inserted_rows = await _ainsert_many(plan, cursor,
+                                        list(insert_objects.values()),
+                                        skip_result=False)
+
+    return (inserted_rows, updated_rows)
+
+
+async def ainsert_or_update_many(model, objects, connection, keys=None,
+                                 using="default", skip_update=False,
+                                 update_fields=None, exclude_fields=None,
+                                 method='select', batch_size=None):
+    '''
+    Asynchronously bulk insert or update Django objects, see
+    `djangobulk.bulk.insert_or_update_many`. All batches run in one
+    transaction.
+
+    :param model: Django model class.
+    :param objects: Iterable of objects of class `model`.
+    :param connection: psycopg 3 `AsyncConnection` or `AsyncConnectionPool`.
+    :param keys: An iterable of field names to use in the WHERE clause on. If
+        none the model's primary key is used.
+    :param using: Django database providing the SQL and value preparation.
+    :param skip_update: Flag to insert only non-existing objects.
+    :param update_fields: An iterable of field names to be updated. If none
+        or empty, all fields of the model are updated.
+    :param exclude_fields: An iterable of field names to be excluded from
+        the set of model fields to be updated.
+    :param method: 'select' or 'on_conflict'.
+    :param batch_size: Maximum objects processed per batch.
+    :returns: A tuple with the inserted and the updated rows.
+    :raises ValueError: if method is unknown, batch_size is not positive or
+        `using` is not PostgreSQL.
+    '''
+    if method not in ASYNC_UPSERT_METHODS:
+        raise ValueError("Unknown upsert method: %r" % (method,))
+    _check_postgresql(connections[using])
+
+    plan = get_write_plan(model, keys, update_fields, exclude_fields, using)
+
+    if method == 'on_conflict':
+        upsert = _aupsert_many
+    else:
+        upsert = _ainsert_or_update_many
+
+    inserted_rows, updated_rows = [], []
+    async with _transaction(connection) as cursor:
+        for batch in _object_batches(objects, batch_size):
+            inserted, updated = await upsert(plan, cursor, batch,
+                                             skip_update=skip_update)
+            inserted_rows.extend(inserted)
+            updated_rows.extend(updated)
+
+    return (inserted_rows, updated_rows)
@@ -5,9 +5,52 @@ Does not attempt to cover all corner cases and related models.
 Originally from http://people.iola.dk/olau/python/bulkops.py
 
 '''
+import binascii
+import copy
+import datetime
+import json
+import re
+from collections import OrderedDict
 from functools import wraps
-from itertools import repeat
+from itertools import chain, islice, repeat
+from operator import itemgetter
 from django.db import models, connections, transaction
+from django.utils import timezone
+
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:
+    # Django < 1.11
+    from django.db.models.sql.datastructures import EmptyResultSet
+
+from djangobulk import tracing
+from djangobulk.statements import execute, executemany
+
+
+# Upper bound on the number of rows packed into a single multi-row
+# statement.
+DEFAULT_ROWS_PER_STATEMENT = 1000
+
+# PostgreSQL's wire protocol caps the bind parameters of a statement at 65535.
+MAX_PARAMETERS = 65535
+
+INSERT_METHODS = ('executemany', 'values', 'copy')
+
+UPDATE_METHODS = ('executemany', 'values')
+
+UPSERT_METHODS = ('select', 'on_conflict', 'staging')
+
+# Formats of the returned rows: a list of dicts, the number of rows, a
+# tuple of the field names and a list of value tuples, a dict of value lists
+# by field name, or an iterator of dicts built as it is consumed.
+RESULT_FORMATS = ('dicts', 'counts', 'tuples', 'columns', 'iterator')
+
+# How objects with duplicate keys are handled: the last or the first one
+# wins, or ValueError is raised.
+DEDUP_POLICIES = ('last', 'first', 'raise')
+
+# Maximum number of rendered statements kept by each write plan.
+MAX_CACHED_STATEMENTS = 64
 
 
 def _model_keys(model, field_names=None):
@@ -82,36 +125,235 @@ def _split_model_fields(model, keys=None, update_fields=None,
     return (key_fields, value_fields)
 
 
-def _prep_values(fields, obj, con, add):
-    if hasattr(obj, 'presave') and callable(obj.presave):
-        obj.presave()
+def _inherits(field, name):
+    """Whether `field` uses the base `Field` implementation of `name`."""
+    method = getattr(type(field), name)
+    base = getattr(models.Field, name)
+    return (getattr(method, '__func__', method) is
+            getattr(base, '__func__', base))
+
+
+try:
+    _UTC = datetime.timezone.utc
+except AttributeError:
+    # Python 2
+    _UTC = timezone.utc
+
+
+def _naive_utc(v):
+    """Convert an aware datetime to naive UTC, leaving other values as is."""
+    if isinstance(v, datetime.datetime) and v.tzinfo is not None:
+        return v.astimezone(_UTC).replace(tzinfo=None)
+    return v
+
+
+def _key(row):
+    """Normalise a key tuple returned by the database like the prepared keys:
+    timestamps are aware with USE_TZ, and prepared as naive UTC."""
+    return tuple(_naive_utc(v) for v in row)
+
+
+def _strip_tz(v):
+    # FIXME: This is necessary for when a DateTimeField is present in
+    # a `keys` parameter of `insert_or_update_many`. Newer versions of
+    # Django make the fields tz aware. The problem here is that
+    # comparing two `datetime` objects with the *same* value but one
+    # being tz aware the other not, actually fails.
+    # It looks like postgresql stores things in UTC by default, so
+    # the code below is dropping the tz info at the Django side.
+    # This is not an elegant solution and also relies on a big
+    # assumption which may not be true (PostgreSQL always in UTC).
+    if v is not None:
+        try:
+            v = v.replace(tzinfo=None)
+        except TypeError:
+            # DateTimeField with no tzinfo
+            pass
+    return v
+
+
+def _field_preparer(field, add):
+    """Return a `prepare(obj, con)` callable for the value of `field`.
+
+    The field type is inspected once here, so that preparing a value is a
+    single call without any dispatch.
+    """
+    attname = field.attname
+    pre_save = field.pre_save
+    # The date fields' own pre_save only differs with auto_now(_add), but
+    # a subclass may override it
+    plain_pre_save = _inherits(field, 'pre_save') or (
+        type(field).pre_save in (models.DateField.pre_save,
+                                 models.DateTimeField.pre_save) and
+        not (field.auto_now or field.auto_now_add)
+    )
+
+    field_type = field.get_internal_type()
+    if field_type in ('DateTimeField', 'DateField', 'UUIDField'):
+        if field_type == 'DateTimeField':
+            if plain_pre_save:
+                return lambda obj, con: _strip_tz(getattr(obj, attname))
+            return lambda obj, con: _strip_tz(pre_save(obj, add))
+        if plain_pre_save:
+            return lambda obj, con: getattr(obj, attname)
+        return lambda obj, con: pre_save(obj, add)
+
+    if plain_pre_save and all(_inherits(field, name) for name in (
+            'get_db_prep_save', 'get_db_prep_value', 'get_prep_value')):
+        # No conversion needed
+        return lambda obj, con: getattr(obj, attname)
+
+    get_db_prep_save = field.get_db_prep_save
+    if plain_pre_save:
+        return lambda obj, con: get_db_prep_save(getattr(obj, attname),
+                                                 connection=con)
+    return lambda obj, con: get_db_prep_save(pre_save(obj, add),
+                                             connection=con)
+
+
+def _row_preparer(model, fields, add):
+    """Return a `prepare(obj, con)` callable for the values of `fields`.
+
+    It returns a tuple of values ready to be sent to the database, after
+    calling the object's `presave` method if the model defines one.
 
-    values = []
+    :param model: Django model class.
+    :param fields: A list of fields of `model`.
+    :param add: Whether the values are prepared for an INSERT.
+    """
+    preparers = tuple(_field_preparer(f, add) for f in fields)
+
+    if callable(getattr(model, 'presave', None)):
+        def prepare(obj, con):
+            obj.presave()
+            return tuple([p(obj, con) for p in preparers])
+    else:
+        def prepare(obj, con):
+            return tuple([p(obj, con) for p in preparers])
+
+    return prepare
+
+
+def _column_fields(model, columns):
+    """Resolve the columns of raw rows to fields of `model`.
+
+    :param columns: An iterable of field names or attribute names, e.g.
+        'author' or 'author_id'.
+    :raises ValueError: if a column is not a field of the model, or two
+        columns are the same field.
+    """
+    by_name = {}
+    for f in model._meta.fields:
+        by_name[f.name] = by_name[f.attname] = f
+
+    fields = []
+    for column in columns:
+        f = by_name.get(column)
+        if f is None:
+            raise ValueError("Unknown column for %s: %r" % (
+                model.__name__, column))
+        if f in fields:
+            raise ValueError("Duplicate column: %r" % (column,))
+        fields.append(f)
+    return fields
+
+
+# Field types whose raw values are parsed, rather than sent as given
+_PARSED_TYPES = ('DateField', 'DateTimeField', 'UUIDField')
+
+
+def _auto_now(field, add):
+    """Whether `field` is set to the current date or time on save."""
+    return isinstance(field, models.DateField) and (
+        field.auto_now or (field.auto_now_add and add))
+
+
+def _sent_as_is(field, add, prepared=False):
+    """Whether the raw values of `field` are sent without any conversion,
+    `prepared` telling whether they are already prepared for the
+    database."""
+    if _auto_now(field, add):
+        return False
+    if prepared:
+        return True
+    if field.get_internal_type() in _PARSED_TYPES:
+        return False
+    return all(_inherits(field, name) for name in (
+        'get_db_prep_save', 'get_db_prep_value', 'get_prep_value'))
+
+
+def _raw_field_preparer(field, add, get, prepared=False):
+    """Return a `prepare(row, con)` callable for the value of `field` in a
+    raw row, `get(row)` returning the value.
+
+    The field's `pre_save` is not called, except that `auto_now` and
+    `auto_now_add` are honoured. Values already `prepared` for the
+    database are sent as they are.
+    """
+    if _sent_as_is(field, add, prepared):
+        return lambda row, con: get(row)
+
+    if _auto_now(field, add):
+        if isinstance(field, models.DateTimeField):
+            get = lambda row: timezone.now()
+        else:
+            get = lambda row: datetime.date.today()
+
+    field_type = field.get_internal_type()
+    if field_type in _PARSED_TYPES:
+        # Parse strings, so that keys compare equal to the values returned
+        # by the database
+        to_python = field.to_python
+        if field_type == 'DateTimeField':
+            # Offsets of the strings are kept by converting to UTC
+            return lambda row, con: _naive_utc(to_python(get(row)))
+        return lambda row, con: to_python(get(row))
+
+    get_db_prep_save = field.get_db_prep_save
+    return lambda row, con: get_db_prep_save(get(row), connection=con)
+
+
+def _raw_row_preparer(fields, add, columns, names=None, prepared=()):
+    """Return a `prepare(row, con)` callable for the values of `fields` in
+    raw rows.
+
+    :param fields: A list of fields.
+    :param add: Whether the values are prepared for an INSERT.
+    :param columns: The fields of the values of a row, in order. Other
+        fields get their default.
+    :param names: The key of each column when rows are dicts, or None when
+        rows are sequences aligned with `columns`.
+    :param prepared: The fields of the columns whose values are already
+        prepared for the database, sent as they are unless `auto_now`
+        applies.
+    """
+    keys = []
     for f in fields:
-        field_type = f.get_internal_type()
-        if field_type in ('DateTimeField', 'DateField', 'UUIDField'):
-            v = f.pre_save(obj, add)
-            # FIXME: This is necessary for when a DateTimeField is present in
-            # a `keys` parameter of `insert_or_update_many`. Newer versions of
-            # Django make the fields tz aware. The problem here is that
-            # comparing two `datetime` objects with the *same* value but one
-            # being tz aware the other not, actually fails.
-            # It looks like postgresql stores things in UTC by default, so
-            # the code below is dropping the tz info at the Django side.
-            # This is not an elegant solution and also relies on a big
-            # assumption which may not be true (PostgreSQL always in UTC).
-            if field_type == 'DateTimeField':
-                if v is not None:
-                    try:
-                        v = v.replace(tzinfo=None)
-                    except TypeError:
-                        # DateTimeField with no tzinfo
-                        pass
-            values.append(v)
+        if f not in columns:
+            keys.append(None)
+        elif names is None:
+            keys.append(columns.index(f))
         else:
-            values.append(f.get_db_prep_save(f.pre_save(obj, add),
-                                             connection=con))
-    return tuple(values)
+            keys.append(names[columns.index(f)])
+
+    if len(fields) > 1 and None not in keys and all(
+            _sent_as_is(f, add, f in prepared) for f in fields):
+        # Take all the values as they are, in a single call
+        get_all = itemgetter(*keys)
+        return lambda row, con: get_all(row)
+
+    preparers = tuple(
+        _raw_field_preparer(f, add, itemgetter(key), f in prepared)
+        if key is not None
+        else _raw_field_preparer(
+            f, add, lambda row, default=f.get_default: default())
+        for f, key in zip(fields, keys)
+    )
+
+    def prepare(row, con):
+        return tuple([p(row, con) for p in preparers])
+
+    return prepare
 
 
 def _build_rows(fields, parameters):
@@ -119,6 +361,566 @@ def _build_rows(fields, parameters):
     return [dict(zip(fields_name, p)) for p in parameters]
 
 
+def _format_rows(names, rows, result='dicts'):
+    """Return `rows`, tuples of the values of the fields `names`, in the
+    format `result`, one of `RESULT_FORMATS`."""
+    names = tuple(names)
+    if result == 'counts':
+        return len(rows)
+    elif result == 'tuples':
+        return (names, rows)
+    elif result == 'columns':
+        return OrderedDict((name, [p[i] for p in rows])
+                           for i, name in enumerate(names))
+    elif result == 'iterator':
+        return (dict(zip(names, p)) for p in rows)
+    return [dict(zip(names, p)) for p in rows]
+
+
+def _check_result(result):
+    if result not in RESULT_FORMATS:
+        raise ValueError("Unknown result format: %r" % (result,))
+
+
+def _batches(iterable, size):
+    """Yield lists of at most `size` items from `iterable`."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _object_batches(objects, batch_size=None):
+    """Split `objects` in batches of at most `batch_size` objects.
+
+    :param objects: An iterable of objects.
+    :param batch_size: Maximum objects per batch. If None, all objects form
+        a single batch.
+    :raises ValueError: if batch_size is not positive.
+    """
+    if batch_size is None:
+        return [objects]
+    if batch_size < 1:
+        raise ValueError("batch_size must be a positive integer")
+    return _batches(objects, batch_size)
+
+
+def _statement_rows(num_fields, rows_per_statement=None, max_parameters=None):
+    """Number of rows that fit in a single multi-row statement.
+
+    :param num_fields: Number of parameters per row.
+    :param rows_per_statement: Maximum rows per statement. Defaults to
+        `DEFAULT_ROWS_PER_STATEMENT`.
+    :param max_parameters: Maximum parameters per statement. Defaults to
+        `MAX_PARAMETERS`.
+    """
+    rows = rows_per_statement or DEFAULT_ROWS_PER_STATEMENT
+    max_parameters = max_parameters or MAX_PARAMETERS
+    if num_fields:
+        rows = min(rows, max_parameters // num_fields)
+    return max(rows, 1)
+
+
+def _default_method(con):
+    if con.vendor == 'postgresql':
+        return 'values'
+    return 'executemany'
+
+
+_AUTO_CAST_TYPES = {'AutoField': 'integer', 'BigAutoField': 'bigint'}
+
+
+def _cast_type(field, con):
+    """Database type to cast a parameter of `field` to.
+
+    Type modifiers are dropped, e.g. varchar(200) becomes varchar: an
+    explicit cast would silently truncate or round the value, where the
+    assignment to the column raises an error.
+    """
+    if hasattr(field, 'cast_db_type'):
+        db_type = field.cast_db_type(con)
+    elif hasattr(field, 'rel_db_type'):
+        # Django < 2.0: maps serial to integer for auto fields
+        db_type = field.rel_db_type(con)
+    else:
+        # Django < 1.10: auto fields are serial columns of these types
+        db_type = (_AUTO_CAST_TYPES.get(field.get_internal_type())
+                   or field.db_type(con))
+    return re.sub(r"\([^)]*\)", "", db_type)
+
+
+def _copy_escape(text):
+    """Escape backslashes and row/column delimiters for COPY text format."""
+    return (text.replace('\\', '\\\\')
+                .replace('\t', '\\t')
+                .replace('\n', '\\n')
+                .replace('\r', '\\r'))
+
+
+def _array_literal(values):
+    items = []
+    for v in values:
+        if v is None:
+            items.append('NULL')
+        elif isinstance(v, (list, tuple)):
+            items.append(_array_literal(v))
+        else:
+            text = _copy_text(v).replace('\\', '\\\\').replace('"', '\\"')
+            items.append('"%s"' % text)
+    return '{%s}' % ','.join(items)
+
+
+try:
+    # Python 2: str is text, binary values are buffers
+    _BINARY_TYPES = (bytearray, memoryview, buffer)  # noqa
+except NameError:
+    _BINARY_TYPES = (bytes, bytearray, memoryview)
+
+
+def _copy_bytes(value):
+    if isinstance(value, memoryview):
+        value = value.tobytes()
+    return '\\x' + binascii.hexlify(bytes(value)).decode('ascii')
+
+
+def _copy_text(value):
+    """Render a prepared, non-null value as PostgreSQL input text."""
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return '%d days %d.%06d seconds' % (
+            value.days, value.seconds, value.microseconds)
+    if isinstance(value, _BINARY_TYPES):
+        return _copy_bytes(value)
+    if isinstance(value, bytes):
+        # Python 2 str
+        return value.decode('utf-8')
+    if isinstance(value, (list, tuple)):
+        return _array_literal(value)
+    if isinstance(value, dict):
+        return json.dumps(value)
+    if hasattr(value, 'adapted'):
+        # psycopg2 adapters: Json dumps its value, Binary wraps bytes
+        if hasattr(value, 'dumps'):
+            return value.dumps(value.adapted)
+        return _copy_bytes(value.adapted)
+    return u'%s' % (value,)
+
+
+def _copy_line(values):
+    return u'\t'.join(
+        '\\N' if v is None else _copy_escape(_copy_text(v))
+        for v in values
+    ) + u'\n'
+
+
+class _Counter(object):
+    """Iterate over `items` once, counting them in `count`."""
+
+    def __init__(self, items):
+        self._items = items
+        self.count = 0
+
+    def __iter__(self):
+        for item in self._items:
+            self.count += 1
+            yield item
+
+
+class _CopyReader(object):
+    """File-like object feeding COPY text lines to `cursor.copy_expert`.
+
+    Lines are rendered lazily as the driver reads, so only a small buffer is
+    held in memory regardless of the number of rows.
+    """
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = u''
+        # Characters read so far
+        self.size = 0
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size is None or size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = u''.join(chunks)
+        if size is None or size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        data = data[:size]
+        self.size += len(data)
+        return data
+
+
+class WritePlan(object):
+    """Fields and SQL templates resolved once for writing a model.
+
+    Plans are cached by `get_write_plan`; call `clear_write_plans` after
+    the schema of a model changes.
+
+    :param model: Django model class.
+    :param keys: An iterable of field names to use in the WHERE clause. If
+        None the model's primary key is used.
+    :param update_fields: An iterable of field names to be updated. If none
+        or empty, all fields of the model are updated.
+    :param exclude_fields: An iterable of field names to be excluded from
+        the set of model fields to be updated.
+    :param using: Database to use.
+    :raises ValueError: if keys is not None and is empty.
+    """
+
+    def __init__(self, model, keys=None, update_fields=None,
+                 exclude_fields=None, using="default"):
+        con = connections[using]
+        quote = con.ops.quote_name
+
+        self.model = model
+        self.using = using
+        self.table = model._meta.db_table
+
+        # Inserted fields, and updated fields (values first, then keys)
+        self.fields = _model_fields(model)
+        self.key_fields, self.value_fields = _split_model_fields(
+            model, keys, update_fields, exclude_fields
+        )
+        self.param_fields = self.value_fields + self.key_fields
+
+        self.prepare_insert = _row_preparer(model, self.fields, True)
+        self.prepare_keys = _row_preparer(model, self.key_fields, False)
+        self.prepare_params = _row_preparer(model, self.param_fields, False)
+
+        # Positions of the key and update fields in an inserted row, None
+        # when a key is not inserted (i.e. the auto primary key).
+        try:
+            self.key_index = [self.fields.index(f) for f in self.key_fields]
+            self.param_index = [self.fields.index(f)
+                                for f in self.param_fields]
+        except ValueError:
+            self.key_index = self.param_index = None
+
+        self.columns = ",".join(quote(f.column) for f in self.fields)
+        self.key_columns = ",".join(quote(f.column) for f in self.key_fields)
+        self.param_columns = ",".join(
+            quote(f.column) for f in self.param_fields
+        )
+
+        insert = "INSERT INTO %s (%s) VALUES " % (self.table, self.columns)
+        insert_row = "(%s)" % ",".join(repeat("%s", len(self.fields)))
+        self.insert_sql = insert + insert_row
+        self.copy_sql = "COPY %s (%s) FROM STDIN" % (self.table, self.columns)
+
+        assignments = ",".join(
+            ("%s=%%s" % quote(f.column))
+            for f in self.value_fields
+        )
+        where_keys = " AND ".join(
+            ("%s=%%s" % quote(f.column))
+            for f in self.key_fields
+        )
+        self.update_sql = "UPDATE %s SET %s WHERE %s" % (
+            self.table, assignments, where_keys)
+
+        assignments = ",".join(
+            ("%s=v.%s" % (quote(f.column), quote(f.column)))
+            for f in self.value_fields
+        )
+        where_keys = " AND ".join(
+            ("%s.%s=v.%s" % (self.table, quote(f.column), quote(f.column)))
+            for f in self.key_fields
+        )
+        cast_row = "(%s)" % ",".join(
+            "%%s::%s" % _cast_type(f, con) for f in self.param_fields
+        )
+
+        key_row = "(%s)" % ",".join(repeat("%s", len(self.key_fields)))
+
+        # Existing keys, with one array parameter per key column so that
+        # the statement does not depend on the number of rows (PostgreSQL)
+        self.select_keys_sql = (
+            "SELECT %s FROM %s WHERE (%s) IN (SELECT * FROM unnest(%s))" % (
+                self.key_columns, self.table, self.key_columns,
+                ",".join("%%s::%s[]" % _cast_type(f, con)
+                         for f in self.key_fields))
+        )
+
+        # Delete by key, with one array parameter per key column
+        # (PostgreSQL)
+        delete_keys = " AND ".join(
+            ("%s.%s=d.%s" % (self.table, quote(f.column), quote(f.column)))
+            for f in self.key_fields
+        )
+        self.delete_keys_sql = (
+            "DELETE FROM %s USING unnest(%s) AS d (%s) WHERE %s" % (
+                self.table,
+                ",".join("%%s::%s[]" % _cast_type(f, con)
+                         for f in self.key_fields),
+                self.key_columns, delete_keys)
+        )
+        delete_returning = " RETURNING " + ",".join(
+            "%s.%s" % (self.table, quote(f.column)) for f in self.key_fields
+        )
+        self.delete_keys_returning_sql = (
+            self.delete_keys_sql + delete_returning)
+        # Rows whose keys are not in the arrays, to be narrowed by a scope.
+        # NULL keys match, but only nullable key fields pay for it: IS NOT
+        # DISTINCT FROM can't be hashed.
+        missing_keys = " AND ".join(
+            ("%s.%s %s d.%s" % (
+                self.table, quote(f.column),
+                "IS NOT DISTINCT FROM" if f.null else "=", quote(f.column)))
+            for f in self.key_fields
+        )
+        self.delete_missing_sql = (
+            "DELETE FROM %s WHERE NOT EXISTS (SELECT 1 FROM unnest(%s) "
+            "AS d (%s) WHERE %s)" % (
+                self.table,
+                ",".join("%%s::%s[]" % _cast_type(f, con)
+                         for f in self.key_fields),
+                self.key_columns, missing_keys)
+        )
+
+        # Whether any value column differs from the incoming row `alias`
+        def changed(alias):
+            return "(%s)" % " OR ".join(
+                "%s.%s IS DISTINCT FROM %s.%s" % (
+                    self.table, quote(f.column), alias, quote(f.column))
+                for f in self.value_fields
+            )
+
+        if self.value_fields:
+            conflict_update = "UPDATE SET " + ",".join(
+                "%s=EXCLUDED.%s" % (quote(f.column), quote(f.column))
+                for f in self.value_fields
+            )
+            conflict_changed = "%s WHERE %s" % (
+                conflict_update, changed("EXCLUDED"))
+        else:
+            conflict_update = conflict_changed = "NOTHING"
+        conflict = " ON CONFLICT (%s) DO %%s RETURNING %s, (xmax = 0)" % (
+            self.key_columns, self.key_columns)
+
+        # Multi-row statements as (prefix, row, suffix)
+        self._templates = {
+            'insert': (insert, insert_row, ""),
+            'update': (
+                "UPDATE %s SET %s FROM (VALUES " % (self.table, assignments),
+                cast_row,
+                ") AS v (%s) WHERE %s" % (self.param_columns, where_keys),
+            ),
+            'update_changed': (
+                "UPDATE %s SET %s FROM (VALUES " % (self.table, assignments),
+                cast_row,
+                ") AS v (%s) WHERE %s AND %s RETURNING %s" % (
+                    self.param_columns, where_keys, changed("v"),
+                    ",".join("v.%s" % quote(f.column)
+                             for f in self.key_fields)),
+            ),
+            'select': (
+                "SELECT %s FROM %s WHERE (%s) IN (" % (
+                    self.key_columns, self.table, self.key_columns),
+                key_row,
+                ")",
+            ),
+            'delete': (
+                "DELETE FROM %s WHERE (%s) IN (" % (
+                    self.table, self.key_columns),
+                key_row,
+                ")",
+            ),
+            'delete_returning': (
+                "DELETE FROM %s WHERE (%s) IN (" % (
+                    self.table, self.key_columns),
+                key_row,
+                ")" + delete_returning,
+            ),
+            'insert_returning': (
+                insert, insert_row,
+                " RETURNING %s" % quote(model._meta.pk.column),
+            ),
+            'upsert': (insert, insert_row, conflict % conflict_update),
+            'upsert_nothing': (insert, insert_row, conflict % "NOTHING"),
+            'upsert_changed': (insert, insert_row,
+                               conflict % conflict_changed),
+        }
+        self._statements = {}
+        self._row_plans = {}
+
+        # Upsert through a temporary staging table
+        stage = quote("bulk_stage_%s" % self.table)
+        stage_keys = " AND ".join(
+            ("%s.%s=s.%s" % (self.table, quote(f.column), quote(f.column)))
+            for f in self.key_fields
+        )
+        stage_update = "UPDATE %s SET %s FROM %s s WHERE %s" % (
+            self.table,
+            ",".join("%s=s.%s" % (quote(f.column), quote(f.column))
+                     for f in self.value_fields),
+            stage, stage_keys)
+        stage_returning = " RETURNING " + ",".join(
+            "s.%s" % quote(f.column) for f in self.param_fields
+        )
+        stage_duplicates = " AND ".join(
+            "s.%s=d.%s" % (quote(f.column), quote(f.column))
+            for f in self.key_fields
+        )
+        self.staging_sql = {
+            'create': (
+                "CREATE TEMPORARY TABLE %s AS SELECT %s FROM %s "
+                "WITH NO DATA; ALTER TABLE %s ADD COLUMN bulk_row bigserial"
+            ) % (stage, self.columns, self.table, stage),
+            'copy': "COPY %s (%s) FROM STDIN" % (stage, self.columns),
+            # Latest row wins
+            'dedup': (
+                "DELETE FROM %s s USING %s d WHERE %s "
+                "AND s.bulk_row < d.bulk_row; ANALYZE %s"
+            ) % (stage, stage, stage_duplicates, stage),
+            # First row wins
+            'dedup_first': (
+                "DELETE FROM %s s USING %s d WHERE %s "
+                "AND s.bulk_row > d.bulk_row; ANALYZE %s"
+            ) % (stage, stage, stage_duplicates, stage),
+            'duplicate': "SELECT %s FROM %s GROUP BY %s "
+                         "HAVING count(*) > 1 LIMIT 1" % (
+                             self.key_columns, stage, self.key_columns),
+            'update': stage_update + stage_returning,
+            'update_changed': "%s AND %s%s" % (
+                stage_update, changed("s"), stage_returning),
+            'unchanged': "SELECT %s FROM %s s JOIN %s ON %s WHERE NOT %s" % (
+                ",".join("s.%s" % quote(f.column)
+                         for f in self.param_fields),
+                stage, self.table, stage_keys, changed("s")),
+            'insert': (
+                "INSERT INTO %s (%s) SELECT %s FROM %s s WHERE NOT EXISTS "
+                "(SELECT 1 FROM %s WHERE %s) RETURNING %s"
+            ) % (self.table, self.columns,
+                 ",".join("s.%s" % quote(f.column) for f in self.fields),
+                 stage, self.table, stage_keys, self.columns),
+            'drop': "DROP TABLE %s" % stage,
+        }
+
+    def statement(self, kind, num_rows):
+        """Render the multi-row statement `kind` for `num_rows` rows.
+
+        :param kind: One of 'insert', 'insert_returning', 'update',
+            'update_changed', 'select', 'delete', 'delete_returning',
+            'upsert', 'upsert_nothing' or 'upsert_changed'.
+        :param num_rows: Number of rows in the statement.
+        """
+        sql = self._statements.get((kind, num_rows))
+        if sql is None:
+            prefix, row, suffix = self._templates[kind]
+            sql = prefix + ",".join(repeat(row, num_rows)) + suffix
+            if len(self._statements) >= MAX_CACHED_STATEMENTS:
+                self._statements.clear()
+            self._statements[(kind, num_rows)] = sql
+        return sql
+
+    def row_plan(self, columns, mapping=False, prepared=None):
+        """Return a copy of the plan preparing raw rows instead of objects.
+
+        The columns are resolved once, and the returned plans are cached.
+
+        :param columns: The field names, or attribute names, of the values
+            of each row. Fields not in the columns get their default.
+        :param mapping: Whether rows are dicts keyed by the column names,
+            rather than sequences aligned with the columns.
+        :param prepared: The columns whose values are already prepared for
+            the database, and are sent as they are, e.g. converted from a
+            DataFrame. `auto_now` still applies.
+        :raises ValueError: if a column is not a field of the model, or is
+            repeated, or a prepared column is not a column.
+        """
+        names = tuple(columns)
+        cache_key = (names, mapping, _names_key(prepared))
+        plan = self._row_plans.get(cache_key)
+        if plan is None:
+            fields = _column_fields(self.model, names)
+            unknown = set(prepared or ()) - set(names)
+            if unknown:
+                raise ValueError("Prepared columns are not columns: %s"
+                                 % ", ".join(sorted(unknown)))
+            prepared = [fields[names.index(n)] for n in prepared or ()]
+            plan = copy.copy(self)
+            keys = names if mapping else None
+            plan.prepare_insert = _raw_row_preparer(self.fields, True,
+                                                    fields, keys, prepared)
+            plan.prepare_keys = _raw_row_preparer(self.key_fields, False,
+                                                  fields, keys, prepared)
+            plan.prepare_params = _raw_row_preparer(
+                self.param_fields, False, fields, keys, prepared)
+            self._row_plans[cache_key] = plan
+        return plan
+
+
+def _row_plan(plan, rows, columns, keys=True, prepared=None):
+    """Return the plan for the raw `rows`, and the rows.
+
+    Whether rows are dicts is found from the first one.
+
+    :param keys: Whether the key fields must be columns.
+    :param prepared: The columns already prepared for the database.
+    :raises ValueError: if the columns are invalid, see
+        `WritePlan.row_plan`.
+    """
+    if keys:
+        names = set(columns)
+        missing = [f.name for f in plan.key_fields
+                   if f.name not in names and f.attname not in names]
+        if missing:
+            raise ValueError("Key fields are not columns: %s"
+                             % ", ".join(missing))
+
+    if isinstance(rows, (list, tuple)):
+        first = rows[0] if rows else None
+    else:
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is not None:
+            rows = chain([first], rows)
+    return (plan.row_plan(columns, isinstance(first, dict), prepared), rows)
+
+
+_write_plans = {}
+
+
+def _names_key(names):
+    if names is None:
+        return None
+    return frozenset(names)
+
+
+def get_write_plan(model, keys=None, update_fields=None, exclude_fields=None,
+                   using="default"):
+    """Return the cached `WritePlan` for the given arguments.
+
+    :raises ValueError: if keys is not None and is empty.
+    """
+    cache_key = (model, _names_key(keys), _names_key(update_fields),
+                 _names_key(exclude_fields), using)
+    plan = _write_plans.get(cache_key)
+    if plan is None:
+        plan = WritePlan(model, keys, update_fields, exclude_fields, using)
+        _write_plans[cache_key] = plan
+    return plan
+
+
+def clear_write_plans():
+    """Drop all cached write plans, e.g. after schema changes or in tests."""
+    _write_plans.clear()
+
+
 def transaction_management(func):
     @wraps(func)
     def _decorator(*args, **kwargs):
@@ -134,30 +936,84 @@ def transaction_management(func):
     return _decorator
 
 
-def _insert_many(model, objects, using="default", skip_result=True):
-    if not objects:
-        return
+def _set_pks(plan, objects, pks):
+    """Assign the primary keys returned by an INSERT to their objects."""
+    attname = plan.model._meta.pk.attname
+    for o, pk in zip(objects, pks):
+        setattr(o, attname, pk)
+        o._state.adding = False
+        o._state.db = plan.using
 
-    con = connections[using]
-
-    fields = _model_fields(model)
-    parameters = [_prep_values(fields, o, con, True) for o in objects]
 
-    table = model._meta.db_table
-    col_names = ",".join(con.ops.quote_name(f.column) for f in fields)
-    placeholders = ",".join(repeat("%s", len(fields)))
+def _insert_many(plan, objects, skip_result=True, method=None,
+                 rows_per_statement=None, max_parameters=None,
+                 set_pks=False):
+    """Bulk insert Django objects.
 
-    sql = "INSERT INTO %s (%s) VALUES (%s)" % (table, col_names, placeholders)
-    con.cursor().executemany(sql, parameters)
-
-    if not skip_result:
-        return _build_rows(fields, parameters)
+    :returns: The prepared rows, or their number with skip_result.
+    """
+    if not objects:
+        return [] if not skip_result else 0
+
+    con = connections[plan.using]
+    method = method or _default_method(con)
+    if method not in INSERT_METHODS:
+        raise ValueError("Unknown insert method: %r" % (method,))
+    if set_pks:
+        if method != 'values' or con.vendor != 'postgresql':
+            raise ValueError("set_pks requires the 'values' insert method "
+                             "on PostgreSQL")
+        # Keep the objects to assign them their primary keys
+        objects = list(objects)
+
+    fields = plan.fields
+    prepare = plan.prepare_insert
+    if skip_result:
+        # Values are prepared as they are sent, and counted
+        parameters = _Counter(prepare(o, con) for o in objects)
+    else:
+        with tracing.phase('prepare') as phase:
+            parameters = [prepare(o, con) for o in objects]
+            phase.add(rows=len(parameters))
 
-    return []
+    cursor = con.cursor()
+    with tracing.phase('insert') as phase:
+        if method == 'executemany':
+            executemany(con, cursor, plan.insert_sql,
+                        phase.count(parameters))
+        elif method == 'copy':
+            if con.vendor != 'postgresql':
+                raise ValueError("The 'copy' insert method requires "
+                                 "PostgreSQL")
+            reader = _CopyReader(_copy_line(p)
+                                 for p in phase.count(parameters))
+            cursor.copy_expert(plan.copy_sql, reader)
+            tracing.record_copy(reader.size)
+        else:
+            # Pack as many rows as allowed in each statement
+            size = _statement_rows(len(fields), rows_per_statement,
+                                   max_parameters)
+            kind = 'insert_returning' if set_pks else 'insert'
+            pks = []
+            for batch in _batches(phase.count(parameters), size):
+                execute(con, cursor, plan.statement(kind, len(batch)),
+                        [v for p in batch for v in p])
+                if set_pks:
+                    # Rows are returned in the order of the VALUES list
+                    pks.extend(row[0] for row in cursor.fetchall())
+            if set_pks:
+                _set_pks(plan, objects, pks)
+
+    if skip_result:
+        return parameters.count
+    return parameters
 
 
 @transaction_management
-def insert_many(model, objects, using="default", skip_result=True):
+def insert_many(model, objects, using="default", skip_result=True,
+                method=None, rows_per_statement=None, max_parameters=None,
+                batch_size=None, set_pks=False, result='dicts',
+                columns=None, prepared_columns=None):
     '''
     Bulk insert list of Django objects. Objects must be of the same
     Django model.
@@ -166,61 +1022,217 @@ def insert_many(model, objects, using="default", skip_result=True):
     raised.
 
     :param model: Django model class.
-    :param objects: List of objects of class `model`.
+    :param objects: Iterable of objects of class `model`.
     :param using: Database to use.
+    :param method: How rows are sent to the database. 'values' packs many
+        rows in each INSERT statement, 'executemany' issues one INSERT per
+        row, 'copy' streams the rows through PostgreSQL's COPY FROM STDIN.
+        Defaults to 'values' on PostgreSQL, 'executemany' otherwise.
+    :param rows_per_statement: Maximum rows per statement for the 'values'
+        method. Defaults to `DEFAULT_ROWS_PER_STATEMENT`.
+    :param max_parameters: Maximum parameters per statement for the 'values'
+        method. Defaults to `MAX_PARAMETERS`.
+    :param batch_size: Maximum objects prepared and sent per batch. If None,
+        all objects are sent in a single batch. Batches are taken lazily from
+        `objects`, so with a generator memory is bounded by the batch size.
+    :param set_pks: Assign the primary keys generated by the database to the
+        objects, using INSERT ... RETURNING. Requires the 'values' method on
+        PostgreSQL.
+    :param result: Format of the inserted rows returned when skip_result
+        is false, one of `RESULT_FORMATS`: 'dicts' (a list of dicts),
+        'counts' (their number), 'tuples' (a tuple of the field names and a
+        list of value tuples), 'columns' (a dict of value lists by field
+        name) or 'iterator' (an iterator of dicts). 'counts' returns the
+        number of rows sent whatever skip_result, without keeping them.
+    :param columns: Field names, or attribute names, of raw rows given as
+        `objects` instead of model instances: sequences aligned with the
+        columns, or dicts keyed by them. No instance is built: only the
+        database preparation of each field runs on the values, and fields
+        that are not columns get their default. See
+        `WritePlan.row_plan`.
+    :param prepared_columns: Columns whose values are already prepared for
+        the database, which are sent as they are, skipping the preparation
+        of their field.
+    :raises ValueError: if method or result is unknown, or method is 'copy'
+        on a database other than PostgreSQL, or batch_size is not positive,
+        or set_pks is used with another method or database or with raw
+        rows, or the columns are invalid.
 
     '''
-
-    return _insert_many(model, objects, using, skip_result)
-
-
-def _update_many(model, objects, key_fields, value_fields,
-                 using="default", skip_result=True):
+    _check_result(result)
+
+    plan = get_write_plan(model, using=using)
+    if columns is not None:
+        if set_pks:
+            raise ValueError("set_pks requires model instances")
+        plan, objects = _row_plan(plan, objects, columns, keys=False,
+                                  prepared=prepared_columns)
+
+    counts = result == 'counts'
+    rows = []
+    num_rows = 0
+    with tracing.call('insert_many', plan):
+        for batch in tracing.batches(_object_batches(objects, batch_size)):
+            batch_rows = _insert_many(plan, batch, skip_result or counts,
+                                      method, rows_per_statement,
+                                      max_parameters, set_pks)
+            if counts:
+                num_rows += batch_rows
+            elif not skip_result:
+                rows.extend(batch_rows)
+
+    if counts:
+        return num_rows
+    if skip_result:
+        return []
+    return _format_rows([f.name for f in plan.fields], rows, result)
+
+
+def _update_many(plan, objects, skip_result=True, method=None,
+                 rows_per_statement=None, max_parameters=None):
     """Bulk update list of Django objects.
 
     Objects must be of the same Django model.
 
-    :param model: Django model class.
-    :param objects: List of objects of class `model`.
-    :param key_fields: A list of field names to use in the WHERE clause.
-    :param value_fields: A list of field names to update.
-    :param using: Database to use.
+    :param plan: `WritePlan` with the key and value fields.
+    :param objects: Iterable of objects of class `plan.model`.
     :param skip_result: don't return update rows. By default true.
+    :param method: 'values' joins the table against a VALUES list so a
+        single statement updates many rows, 'executemany' issues one UPDATE
+        per row. Defaults to 'values' on PostgreSQL, 'executemany'
+        otherwise.
+    :param rows_per_statement: Maximum rows per statement for the 'values'
+        method.
+    :param max_parameters: Maximum parameters per statement for the 'values'
+        method.
+    :raises ValueError: if method is unknown.
     """
     if not objects:
         return
 
-    con = connections[using]
+    con = connections[plan.using]
+    method = method or _default_method(con)
+    if method not in UPDATE_METHODS:
+        raise ValueError("Unknown update method: %r" % (method,))
 
     # Combine the fields for the parameter list
-    param_fields = value_fields + key_fields
-    parameters = [
-        _prep_values(param_fields, o, con, False)
-        for o in objects
-    ]
+    param_fields = plan.param_fields
+    prepare = plan.prepare_params
+    with tracing.phase('prepare') as phase:
+        parameters = [prepare(o, con) for o in objects]
+        phase.add(rows=len(parameters))
 
-    # Build the SQL
-    table = model._meta.db_table
-    assignments = ",".join(
-        ("%s=%%s" % con.ops.quote_name(f.column))
-        for f in value_fields
-    )
-    where_keys = " AND ".join(
-        ("%s=%%s" % con.ops.quote_name(f.column))
-        for f in key_fields
-    )
-    sql = "UPDATE %s SET %s WHERE %s" % (table, assignments, where_keys)
-    con.cursor().executemany(sql, parameters)
+    cursor = con.cursor()
+    with tracing.phase('update', len(parameters)):
+        if method == 'executemany':
+            executemany(con, cursor, plan.update_sql, parameters)
+        else:
+            # A row can only be updated once per statement: latest wins
+            num_keys = len(plan.key_fields)
+            rows = OrderedDict((p[-num_keys:], p) for p in parameters)
+
+            size = _statement_rows(len(param_fields), rows_per_statement,
+                                   max_parameters)
+            for batch in _batches(rows.values(), size):
+                execute(con, cursor, plan.statement('update', len(batch)),
+                        [v for p in batch for v in p])
 
     if not skip_result:
-        return _build_rows(param_fields, parameters)
+        return parameters
 
     return []
 
 
+def _update_changed_many(plan, objects, rows_per_statement=None,
+                         max_parameters=None):
+    """Bulk update the rows of objects with at least one changed value.
+
+    Rows are compared with IS DISTINCT FROM, so unchanged rows are not
+    rewritten. Requires PostgreSQL.
+
+    :returns: A tuple with the parameters of the updated objects and of the
+        untouched ones, i.e. unchanged or not found.
+    """
+    con = connections[plan.using]
+    if con.vendor != 'postgresql':
+        raise ValueError("skip_unchanged requires PostgreSQL")
+
+    prepare = plan.prepare_params
+    num_keys = len(plan.key_fields)
+
+    # A row can only be updated once per statement: latest wins
+    rows = OrderedDict()
+    with tracing.phase('prepare') as phase:
+        for o in phase.count(objects):
+            p = prepare(o, con)
+            rows[p[-num_keys:]] = p
+
+    if not plan.value_fields:
+        return ([], list(rows.values()))
+
+    updated_keys = set()
+    cursor = con.cursor()
+    size = _statement_rows(len(plan.param_fields), rows_per_statement,
+                           max_parameters)
+    with tracing.phase('update', len(rows)):
+        for batch in _batches(rows.values(), size):
+            execute(con, cursor,
+                    plan.statement('update_changed', len(batch)),
+                    [v for p in batch for v in p])
+            updated_keys.update(_key(row) for row in cursor.fetchall())
+
+    updated, untouched = [], []
+    for k, p in rows.items():
+        (updated if k in updated_keys else untouched).append(p)
+    return (updated, untouched)
+
+
+def _dirty_groups(plan, objects):
+    """Group objects by the set of value fields they changed.
+
+    Objects without dirty tracking (see
+    `djangobulk.tracking.DirtyFieldsMixin`) or never loaded from the
+    database are grouped with all value fields.
+
+    :returns: A list of (plan, objects) tuples, where each plan only updates
+        the fields changed by its objects, and a list of the objects with
+        no changed field.
+    """
+    key_names = [f.name for f in plan.key_fields]
+    all_names = tuple(f.name for f in plan.value_fields)
+
+    groups = OrderedDict()
+    clean = []
+    for o in objects:
+        dirty = getattr(o, 'get_dirty_fields', lambda: None)()
+        if dirty is None:
+            names = all_names
+        else:
+            names = tuple(name for name in all_names if name in dirty)
+        if names:
+            groups.setdefault(names, []).append(o)
+        else:
+            clean.append(o)
+
+    return ([
+        (get_write_plan(plan.model, key_names, names, using=plan.using),
+         group)
+        for names, group in groups.items()
+    ], clean)
+
+
+def _mark_clean(objects):
+    for o in objects:
+        mark_clean = getattr(o, 'mark_clean', None)
+        if mark_clean is not None:
+            mark_clean()
+
+
 @transaction_management
 def update_many(model, objects, keys=None, using="default", update_fields=None,
-                exclude_fields=None):
+                exclude_fields=None, method=None, rows_per_statement=None,
+                max_parameters=None, batch_size=None, skip_unchanged=False,
+                only_dirty=False, columns=None):
     '''
     Bulk update list of Django objects. Objects must be of the same
     Django model.
@@ -229,7 +1241,7 @@ def update_many(model, objects, keys=None, using="default", update_fields=None,
     raised.
 
     :param model: Django model class.
-    :param objects: List of objects of class `model`.
+    :param objects: Iterable of objects of class `model`.
     :param keys: An iterable of field names to use in the WHERE clause on. If
         none the model's primary key is used.
     :param using: Database to use.
@@ -237,33 +1249,374 @@ def update_many(model, objects, keys=None, using="default", update_fields=None,
         or empty, all fields of the model are updated.
     :param exclude_fields: An iterable of field names to be excluded from
         the set of model fields to be updated.
-    :raises ValueError: if keys is not None and is empty.
+    :param method: 'values' updates many rows per statement from a VALUES
+        list, 'executemany' issues one UPDATE per row. Defaults to 'values'
+        on PostgreSQL, 'executemany' otherwise.
+    :param rows_per_statement: Maximum rows per statement for the 'values'
+        method. Defaults to `DEFAULT_ROWS_PER_STATEMENT`.
+    :param max_parameters: Maximum parameters per statement for the 'values'
+        method. Defaults to `MAX_PARAMETERS`.
+    :param batch_size: Maximum objects prepared and sent per batch. If None,
+        all objects are sent in a single batch. Batches are taken lazily from
+        `objects`, so with a generator memory is bounded by the batch size.
+    :param skip_unchanged: Only update rows where at least one updated field
+        is distinct from the object's value, so unchanged rows are not
+        rewritten. Requires PostgreSQL, and method is then ignored.
+    :param only_dirty: Only update the fields each object changed since it
+        was loaded, as tracked by `djangobulk.tracking.DirtyFieldsMixin`.
+        Objects are grouped by their set of changed fields, with one batched
+        update per group, and objects without changes are skipped. Updated
+        objects are then marked clean.
+    :returns: With skip_unchanged, a tuple with the number of objects that
+        updated a row and the number of objects left untouched, because
+        their row was unchanged, not found or, with only_dirty, had no
+        changed field. None otherwise.
+    :param columns: Field names of raw rows given as `objects`, see
+        `insert_many`. The key fields must be columns, and if update_fields
+        is None only the columns are updated.
+    :raises ValueError: if keys is not None and is empty, method is unknown,
+        batch_size is not positive, skip_unchanged is used on a database
+        other than PostgreSQL, the columns are invalid or only_dirty is used
+        with raw rows.
     '''
 
-    key_fields, value_fields = _split_model_fields(
-        model, keys, update_fields, exclude_fields
-    )
+    if columns is not None:
+        if only_dirty:
+            raise ValueError("only_dirty requires model instances")
+        if update_fields is None:
+            update_fields = [f.name for f in _column_fields(model, columns)]
+    plan = get_write_plan(model, keys, update_fields, exclude_fields, using)
+    if columns is not None:
+        plan, objects = _row_plan(plan, objects, columns)
+
+    num_updated = num_untouched = 0
+    with tracing.call('update_many', plan):
+        for batch in tracing.batches(_object_batches(objects, batch_size)):
+            if only_dirty:
+                with tracing.phase('filter', len(batch)):
+                    groups, clean = _dirty_groups(plan, batch)
+                num_untouched += len(clean)
+            else:
+                groups = [(plan, batch)]
+
+            for group_plan, group in groups:
+                if skip_unchanged:
+                    updated, untouched = _update_changed_many(
+                        group_plan, group, rows_per_statement,
+                        max_parameters)
+                    num_updated += len(updated)
+                    num_untouched += len(untouched)
+                else:
+                    _update_many(group_plan, group, method=method,
+                                 rows_per_statement=rows_per_statement,
+                                 max_parameters=max_parameters)
+                if only_dirty:
+                    _mark_clean(group)
+
+    if skip_unchanged:
+        return (num_updated, num_untouched)
+
+
+def _filter_objects(object_keys, dedup='last'):
+    '''Filter out objects with duplicate key fields.
+
+    :param object_keys: An iterable of (object, prepared keys) tuples.
+    :param dedup: One of `DEDUP_POLICIES`.
+    :returns: A list of the (object, prepared keys) tuples kept, in order of
+        first appearance of their keys.
+    :raises ValueError: if dedup is 'raise' and two objects share their
+        keys.
+    '''
+    unique = OrderedDict()
+    if dedup == 'last':
+        for o, k in object_keys:
+            unique[k] = o
+    elif dedup == 'first':
+        for o, k in object_keys:
+            unique.setdefault(k, o)
+    else:
+        for o, k in object_keys:
+            if k in unique:
+                raise ValueError("Duplicate keys: %r" % (k,))
+            unique[k] = o
+    return [(o, k) for k, o in unique.items()]
+
+
+def _upsert_many(plan, objects, skip_update=False, skip_unchanged=False,
+                 dedup='last', rows_per_statement=None, max_parameters=None,
+                 seen=None):
+    """Bulk insert or update using INSERT ... ON CONFLICT.
+
+    Requires PostgreSQL 9.5+ and a unique index on the key fields.
+
+    :returns: A tuple with the inserted, the updated and the unchanged rows,
+        as value tuples of `plan.fields` for the inserted rows and of
+        `plan.param_fields` for the others. Rows are only reported as
+        unchanged with skip_unchanged.
+    :raises ValueError: if a key field is not an inserted field, or dedup is
+        'raise' and two objects share their keys.
+    """
+    if plan.key_index is None:
+        raise ValueError("ON CONFLICT requires inserted key fields, "
+                         "not the auto primary key")
+
+    con = connections[plan.using]
+
+    fields = plan.fields
+    key_index = plan.key_index
+    prepare = plan.prepare_insert
+    with tracing.phase('prepare') as phase:
+        parameters = [prepare(o, con) for o in phase.count(objects)]
+
+    # Rows with duplicate keys cannot be in the same statement
+    with tracing.phase('filter', len(parameters)):
+        rows = OrderedDict((k, p) for (p, k) in _filter_objects(
+            ((p, tuple(p[i] for i in key_index)) for p in parameters),
+            dedup))
+    if seen is not None:
+        seen.extend(rows)
+
+    if skip_update:
+        kind = 'upsert_nothing'
+    elif skip_unchanged:
+        kind = 'upsert_changed'
+    else:
+        kind = 'upsert'
+    param_index = plan.param_index
+    inserted, updated, unchanged = [], [], []
+    cursor = con.cursor()
+    size = _statement_rows(len(fields), rows_per_statement, max_parameters)
+    with tracing.phase('upsert', len(rows)):
+        for batch in _batches(rows.items(), size):
+            execute(con, cursor, plan.statement(kind, len(batch)),
+                    [v for (_, p) in batch for v in p])
+            returned = dict((_key(row[:-1]), row[-1])
+                            for row in cursor.fetchall())
+            for k, p in batch:
+                if k not in returned:
+                    if skip_unchanged:
+                        unchanged.append(tuple(p[i] for i in param_index))
+                elif returned[k]:
+                    inserted.append(p)
+                else:
+                    updated.append(tuple(p[i] for i in param_index))
+
+    return (inserted, updated, unchanged)
+
+
+def _staging_upsert_many(plan, objects, skip_update=False,
+                         skip_unchanged=False, dedup='last', seen=None):
+    """Bulk insert or update through a temporary staging table.
+
+    The objects are copied into a temporary table, then the existing rows
+    are updated and the new ones inserted by two set-based statements joined
+    on the key fields. Requires PostgreSQL.
+
+    :returns: A tuple with the inserted, the updated and the unchanged rows,
+        as value tuples of `plan.fields` for the inserted rows and of
+        `plan.param_fields` for the others. Rows are only reported as
+        unchanged with skip_unchanged.
+    :raises ValueError: if a key field is not an inserted field, the
+        database is not PostgreSQL, or dedup is 'raise' and two objects
+        share their keys.
+    """
+    if plan.key_index is None:
+        raise ValueError("The staging method requires inserted key fields, "
+                         "not the auto primary key")
 
-    _update_many(model, objects, key_fields, value_fields, using)
+    con = connections[plan.using]
+    if con.vendor != 'postgresql':
+        raise ValueError("The staging method requires PostgreSQL")
 
+    sql = plan.staging_sql
+    prepare = plan.prepare_insert
+    if seen is not None:
+        key_index = plan.key_index
+        prepare_insert = prepare
 
-def _filter_objects(con, objects, key_fields):
-    '''Fitler out objects with duplicate key fields.'''
-    keyset = set()
+        def prepare(obj, con):
+            p = prepare_insert(obj, con)
+            seen.append(tuple(p[i] for i in key_index))
+            return p
 
-    # reverse = latest wins
-    for o in reversed(objects):
-        okeys = _prep_values(key_fields, o, con, False)
-        if okeys in keyset:
-            continue
-        keyset.add(okeys)
-        yield o
+    cursor = con.cursor()
+
+    def run(name):
+        tracing.record_statement(())
+        cursor.execute(sql[name])
+
+    with tracing.phase('copy') as phase:
+        run('create')
+        reader = _CopyReader(_copy_line(prepare(o, con))
+                             for o in phase.count(objects))
+        cursor.copy_expert(sql['copy'], reader)
+        tracing.record_copy(reader.size)
+        if dedup == 'raise':
+            run('duplicate')
+            duplicate = cursor.fetchone()
+            if duplicate is not None:
+                run('drop')
+                raise ValueError("Duplicate keys: %r" % (duplicate,))
+        run('dedup_first' if dedup == 'first' else 'dedup')
+
+    updated, unchanged = [], []
+    if not skip_update and plan.value_fields:
+        with tracing.phase('update') as phase:
+            if skip_unchanged:
+                run('unchanged')
+                unchanged = cursor.fetchall()
+                run('update_changed')
+            else:
+                run('update')
+            updated = cursor.fetchall()
+            phase.add(rows=len(updated))
+
+    with tracing.phase('insert') as phase:
+        run('insert')
+        inserted = cursor.fetchall()
+        phase.add(rows=len(inserted))
+
+    run('drop')
+
+    return (inserted, updated, unchanged)
+
+
+def _insert_or_update_many(plan, objects, skip_update=False,
+                           skip_unchanged=False, dedup='last', seen=None):
+    """Bulk insert or update by first selecting the existing keys.
+
+    :returns: A tuple with the inserted, the updated and the unchanged rows,
+        as value tuples of `plan.fields` for the inserted rows and of
+        `plan.param_fields` for the others. Rows are only reported as
+        unchanged with skip_unchanged.
+    :raises ValueError: if dedup is 'raise' and two objects share their
+        keys.
+    """
+    if not objects:
+        return ([], [], [])
+
+    con = connections[plan.using]
+
+    # Prepare field values before insert/update
+    prepare_keys = plan.prepare_keys
+    with tracing.phase('prepare') as phase:
+        object_keys = [(o, prepare_keys(o, con)) for o in objects]
+        phase.add(rows=len(object_keys))
+    if not object_keys:
+        # An exhausted iterator
+        return ([], [], [])
+    if seen is not None:
+        seen.extend(k for (_, k) in object_keys)
+
+    if dedup != 'last':
+        # Drop the later duplicates, or raise, before updating any of them
+        with tracing.phase('filter', len(object_keys)):
+            object_keys = _filter_objects(object_keys, dedup)
+
+    # Select key tuples from the database to find out which ones need to be
+    # updated and which ones need to be inserted.
+    cursor = con.cursor()
+    with tracing.phase('select', len(object_keys)):
+        if con.vendor == 'postgresql':
+            # One array parameter per key column: a constant statement
+            columns = zip(*(k for (_, k) in object_keys))
+            execute(con, cursor, plan.select_keys_sql,
+                    [list(c) for c in columns])
+        else:
+            execute(con, cursor,
+                    plan.statement('select', len(object_keys)),
+                    [i for (_, k) in object_keys for i in k])
+        existing = set(_key(row) for row in cursor.fetchall())
+
+    updated_rows, unchanged_rows = [], []
+    if not skip_update:
+        # Find the objects that need to be updated
+        update_objects = [o for (o, k) in object_keys if k in existing]
+
+        if skip_unchanged:
+            updated_rows, unchanged_rows = _update_changed_many(
+                plan, update_objects)
+        else:
+            updated_rows = _update_many(
+                plan, update_objects,
+                skip_result=False,
+            ) or []
+
+    # Find the objects that need to be inserted.
+    insert_keys = [(o, k) for (o, k) in object_keys if k not in existing]
+
+    # Filter out any duplicates in the insertion, reusing the prepared keys
+    with tracing.phase('filter', len(insert_keys)):
+        filtered_objects = [o for (o, _) in _filter_objects(insert_keys)]
+
+    inserted_rows = _insert_many(plan, filtered_objects, skip_result=False)
+
+    return (inserted_rows, updated_rows, unchanged_rows)
+
+
+def _upsert_objects(model, objects, keys, using, skip_update,
+                    update_fields, exclude_fields, method, batch_size,
+                    skip_unchanged, dedup, result, columns, seen=None,
+                    prepared_columns=None):
+    """Implement `insert_or_update_many`.
+
+    :param seen: A list extended with the prepared keys of the objects.
+    """
+    if method not in UPSERT_METHODS:
+        raise ValueError("Unknown upsert method: %r" % (method,))
+    if dedup not in DEDUP_POLICIES:
+        raise ValueError("Unknown dedup policy: %r" % (dedup,))
+    _check_result(result)
+
+    if columns is not None and update_fields is None:
+        update_fields = [f.name for f in _column_fields(model, columns)]
+    plan = get_write_plan(model, keys, update_fields, exclude_fields, using)
+    if columns is not None:
+        plan, objects = _row_plan(plan, objects, columns,
+                                  prepared=prepared_columns)
+
+    if method == 'on_conflict':
+        upsert = _upsert_many
+    elif method == 'staging':
+        upsert = _staging_upsert_many
+    else:
+        upsert = _insert_or_update_many
+
+    # Inserted, updated and unchanged rows, or their numbers
+    results = [0, 0, 0] if result == 'counts' else [[], [], []]
+    if objects:
+        with tracing.call('insert_or_update_many', plan):
+            for batch in tracing.batches(_object_batches(objects,
+                                                         batch_size)):
+                batch_results = upsert(
+                    plan, batch, skip_update=skip_update,
+                    skip_unchanged=skip_unchanged, dedup=dedup,
+                    seen=seen)
+                for i, rows in enumerate(batch_results):
+                    if result == 'counts':
+                        results[i] += len(rows)
+                    else:
+                        results[i].extend(rows)
+
+    if result != 'counts':
+        names = [f.name for f in plan.fields]
+        param_names = [f.name for f in plan.param_fields]
+        results = [_format_rows(names, results[0], result),
+                   _format_rows(param_names, results[1], result),
+                   _format_rows(param_names, results[2], result)]
+
+    if skip_unchanged:
+        return tuple(results)
+    return tuple(results[:2])
 
 
 @transaction_management
 def insert_or_update_many(model, objects, keys=None, using="default",
                           skip_update=False, update_fields=None,
-                          exclude_fields=None):
+                          exclude_fields=None, method='select',
+                          batch_size=None, skip_unchanged=False,
+                          dedup='last', result='dicts', columns=None,
+                          prepared_columns=None):
     '''
     Bulk insert or update a list of Django objects. This works by
     first selecting each object's keys from the database. If an
@@ -271,8 +1624,23 @@ def insert_or_update_many(model, objects, keys=None, using="default",
 
     Does not work with SQLite as it does not support tuple comparison.
 
+    With `method='on_conflict'` the whole operation is done by batched
+    INSERT ... ON CONFLICT statements instead, which is faster and free of
+    races between concurrent writers. It requires PostgreSQL 9.5+ and a
+    unique index on the key fields.
+
+    With `method='staging'` the objects are copied into a temporary table,
+    then the existing rows are updated and the new ones inserted by two
+    set-based statements. This suits very large inputs, and requires
+    PostgreSQL. Returned rows hold the values as stored in the database.
+
+    With `batch_size` the objects are processed in batches, each one doing
+    its own select, update and insert. Objects with duplicate keys in
+    different batches are then inserted by the first batch and updated by
+    the later ones, whatever the dedup policy.
+
     :param model: Django model class.
-    :param objects: List of objects of class `model`.
+    :param objects: Iterable of objects of class `model`.
     :param keys: An iterable of field names to use in the WHERE clause on. If
         none the model's primary key is used.
     :param using: Database to use.
@@ -281,61 +1649,233 @@ def insert_or_update_many(model, objects, keys=None, using="default",
         or empty, all fields of the model are updated.
     :param exclude_fields: An iterable of field names to be excluded from
         the set of model fields to be updated.
-    :raises ValueError: if keys is not None and is empty.
+    :param method: 'select', 'on_conflict' or 'staging'.
+    :param batch_size: Maximum objects processed per batch. If None, all
+        objects are processed in a single batch. Batches are taken lazily
+        from `objects`, so with a generator memory is bounded by the batch
+        size.
+    :param skip_unchanged: Only update rows where at least one updated field
+        is distinct from the object's value, so unchanged rows are not
+        rewritten. Requires PostgreSQL.
+    :param dedup: How objects sharing their keys within a batch are
+        handled: 'last' writes the last one, 'first' the first one, and
+        'raise' raises ValueError before writing the batch.
+    :param result: Format of the returned rows, see `insert_many`. With
+        'counts' only the numbers of rows are returned, and no per-row
+        result is kept across batches.
+    :param columns: Field names of raw rows given as `objects`, see
+        `insert_many`. The key fields must be columns, and if update_fields
+        is None only the columns are updated.
+    :param prepared_columns: Columns whose values are already prepared for
+        the database, see `insert_many`.
+    :returns: A tuple with the inserted and the updated rows. With
+        skip_unchanged, a tuple with the inserted, the updated and the
+        unchanged rows.
+    :raises ValueError: if keys is not None and is empty, method, dedup or
+        result is unknown, batch_size is not positive, skip_unchanged is
+        used on a database other than PostgreSQL, dedup is 'raise' and two
+        objects share their keys, or the columns are invalid.
     '''
+    return _upsert_objects(
+        model, objects, keys, using, skip_update, update_fields,
+        exclude_fields, method, batch_size, skip_unchanged, dedup, result,
+        columns, prepared_columns=prepared_columns)
 
-    if not objects:
-        return ([], [])
 
-    con = connections[using]
+def _delete_many(plan, objects, returning=False):
+    """Bulk delete the rows with the keys of `objects`.
 
-    # Select key tuples from the database to find out which ones need to be
-    # updated and which ones need to be inserted.
+    :param returning: Whether to return the keys of the deleted rows.
+    :returns: The number of deleted rows, or with returning a list of the
+        key tuples of the deleted rows.
+    """
+    con = connections[plan.using]
+    prepare_keys = plan.prepare_keys
+    with tracing.phase('prepare') as phase:
+        keys = [prepare_keys(o, con) for o in objects]
+        phase.add(rows=len(keys))
+    if not keys:
+        return [] if returning else 0
 
-    key_fields, value_fields = _split_model_fields(
-        model, keys, update_fields, exclude_fields
-    )
+    cursor = con.cursor()
+    deleted, count = [], 0
+    with tracing.phase('delete', len(keys)):
+        if con.vendor == 'postgresql':
+            # One array parameter per key column: a constant statement
+            sql = (plan.delete_keys_returning_sql if returning
+                   else plan.delete_keys_sql)
+            execute(con, cursor, sql, [list(c) for c in zip(*keys)])
+            if returning:
+                deleted = cursor.fetchall()
+            count = cursor.rowcount
+        else:
+            kind = 'delete_returning' if returning else 'delete'
+            size = _statement_rows(len(plan.key_fields))
+            for batch in _batches(keys, size):
+                execute(con, cursor, plan.statement(kind, len(batch)),
+                        [v for k in batch for v in k])
+                if returning:
+                    deleted.extend(cursor.fetchall())
+                count += cursor.rowcount
 
-    # Prepare field values before insert/update
-    object_keys = [
-        (o, _prep_values(key_fields, o, con, False))
-        for o in objects
-    ]
-    parameters = [i for (_, k) in object_keys for i in k]
+    if returning:
+        return deleted
+    return count
 
-    table = model._meta.db_table
-    col_names = ",".join(con.ops.quote_name(f.column) for f in key_fields)
 
-    # repeat tuple values
-    tuple_placeholder = "(%s)" % ",".join(repeat("%s", len(key_fields)))
-    placeholders = ",".join(repeat(tuple_placeholder, len(objects)))
+@transaction_management
+def delete_many(model, objects, keys=None, using="default",
+                batch_size=None, result='counts'):
+    '''
+    Bulk delete the rows matching the keys of Django objects, or of key
+    tuples, with set-based DELETE statements. Objects must be of the same
+    Django model.
 
-    sql = "SELECT %s FROM %s WHERE (%s) IN (%s)" % (
-        col_names, table, col_names, placeholders)
-    cursor = con.cursor()
-    cursor.execute(sql, parameters)
-    existing = set(cursor.fetchall())
+    Note that delete is not called, signals on the model are not raised and
+    related rows are not collected: the database's ON DELETE actions apply.
 
-    updated_rows = []
-    if not skip_update:
-        # Find the objects that need to be updated
-        update_objects = [o for (o, k) in object_keys if k in existing]
+    :param model: Django model class.
+    :param objects: Iterable of objects of class `model`, or of key tuples
+        aligned with `keys` (or dicts keyed by them), or of key values if
+        there is a single key field.
+    :param keys: An iterable of field names to match the rows on. If none
+        the model's primary key is used.
+    :param using: Database to use.
+    :param batch_size: Maximum objects deleted per batch. If None, all
+        objects are deleted in a single batch. Batches are taken lazily
+        from `objects`.
+    :param result: 'counts' to return the number of deleted rows, or a
+        format of `RESULT_FORMATS` to return the keys of the deleted rows
+        with DELETE ... RETURNING, see `insert_many`.
+    :returns: The number of deleted rows, or their keys, in the order of
+        the fields of the model.
+    :raises ValueError: if keys is not None and is empty, result is
+        unknown, or batch_size is not positive.
+    '''
+    _check_result(result)
+
+    columns = list(keys) if keys is not None else [model._meta.pk.name]
+    plan = get_write_plan(model, keys and columns, using=using)
+
+    objects = iter(objects)
+    first = next(objects, None)
+    if first is not None:
+        objects = chain([first], objects)
+        if not isinstance(first, model):
+            if len(columns) == 1 and not isinstance(
+                    first, (tuple, list, dict)):
+                # Bare values of a single key field
+                objects = ((o,) for o in objects)
+            plan, objects = _row_plan(plan, objects, columns)
+
+    returning = result != 'counts'
+    rows = []
+    count = 0
+    with tracing.call('delete_many', plan):
+        for batch in tracing.batches(_object_batches(objects, batch_size)):
+            deleted = _delete_many(plan, batch, returning)
+            if returning:
+                rows.extend(deleted)
+            else:
+                count += deleted
+
+    if not returning:
+        return count
+    return _format_rows([f.name for f in plan.key_fields], rows, result)
+
+
+def _delete_missing(plan, keys, scope=None):
+    """Delete the rows matching `scope` whose keys are not in `keys`, in a
+    single statement.
+
+    :param keys: A list of prepared key tuples.
+    :param scope: A dict of filter arguments of the deleted rows. If None
+        or empty, all the rows of the table.
+    :returns: The number of deleted rows.
+    """
+    con = connections[plan.using]
+    sql = plan.delete_missing_sql
+    params = [[k[i] for k in keys] for i in range(len(plan.key_fields))]
+    if scope:
+        # Any lookup, spanning relations or not, through a subquery
+        pk = plan.model._meta.pk
+        query = plan.model._base_manager.using(plan.using).filter(
+            **scope).values(pk.name).query
+        try:
+            scope_sql, scope_params = query.get_compiler(
+                plan.using).as_sql()
+        except EmptyResultSet:
+            # The scope can't match any row
+            return 0
+        sql += " AND %s IN (%s)" % (con.ops.quote_name(pk.column),
+                                    scope_sql)
+        params.extend(scope_params)
 
-        updated_rows = _update_many(
-            model, update_objects,
-            key_fields=key_fields,
-            value_fields=value_fields,
-            using=using,
-            skip_result=False,
-        )
+    cursor = con.cursor()
+    with tracing.phase('delete', len(keys)):
+        execute(con, cursor, sql, params)
+    return cursor.rowcount
 
-    # Find the objects that need to be inserted.
-    insert_objects = [o for (o, k) in object_keys if k not in existing]
 
-    # Filter out any duplicates in the insertion
-    filtered_objects = _filter_objects(con, insert_objects, key_fields)
+@transaction_management
+def sync_many(model, objects, keys=None, scope=None, using="default",
+              update_fields=None, exclude_fields=None, method='select',
+              batch_size=None, skip_unchanged=False, dedup='last',
+              columns=None):
+    '''
+    Synchronise the rows of a model within a scope with a list of Django
+    objects: the objects are inserted or updated as by
+    `insert_or_update_many`, then the rows matching the scope whose keys
+    are not those of any object are deleted, by a single statement. The
+    keys of the table are not read.
 
-    inserted_rows = _insert_many(model, filtered_objects, using=using,
-                                 skip_result=False)
+    Requires PostgreSQL. Only the keys of the objects are kept in memory
+    across batches.
 
-    return (inserted_rows, updated_rows)
+    Note that delete is not called and signals on the model are not
+    raised.
+
+    :param model: Django model class.
+    :param objects: Iterable of objects of class `model`, or raw rows with
+        `columns`.
+    :param keys: An iterable of field names identifying the rows. If none
+        the model's primary key is used.
+    :param scope: A dict of filter arguments, e.g. {'catalogue': 'books'},
+        of the rows deleted when missing from the objects. If None or
+        empty, any row of the table missing from the objects is deleted.
+    :param using: Database to use.
+    :param update_fields: An iterable of field names to be updated. If none
+        or empty, all fields of the model are updated.
+    :param exclude_fields: An iterable of field names to be excluded from
+        the set of model fields to be updated.
+    :param method: 'select', 'on_conflict' or 'staging'.
+    :param batch_size: Maximum objects upserted per batch.
+    :param skip_unchanged: Only update rows where at least one updated field
+        changed.
+    :param dedup: 'last', 'first' or 'raise', for objects of a batch sharing
+        their keys.
+    :param columns: Field names of raw rows given as `objects`, see
+        `insert_or_update_many`.
+    :returns: A tuple with the numbers of inserted, updated and deleted
+        rows. With skip_unchanged, a tuple with the numbers of inserted,
+        updated, unchanged and deleted rows.
+    :raises ValueError: if the database is not PostgreSQL, or the arguments
+        are invalid for `insert_or_update_many`.
+    '''
+    con = connections[using]
+    if con.vendor != 'postgresql':
+        raise ValueError("sync_many requires PostgreSQL")
+
+    if keys is not None:
+        keys = list(keys)
+    plan = get_write_plan(model, keys, using=using)
+
+    # The keys of the objects, as prepared by the upsert
+    seen = []
+    counts = _upsert_objects(
+        model, objects, keys, using, False, update_fields, exclude_fields,
+        method, batch_size, skip_unchanged, dedup, 'counts', columns, seen)
+
+    with tracing.call('sync_many', plan):
+        deleted = _delete_missing(plan, seen, scope)
+    return counts + (deleted,)
@@ -0,0 +1,192 @@
+'''
+Bulk insert or update from pandas DataFrames and NumPy arrays.
+
+Each column is mapped to its model field once and converted as a whole
+(datetimes, nullable integers, UUIDs, missing values), then the rows are
+fed as raw rows to `djangobulk.bulk`, so no model instance, dict or per-row
+conversion is built in Python.
+
+Requires pandas: pip install django-bulk-compat[frames]
+
+'''
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from django.db import connections, models
+
+from djangobulk.bulk import insert_many, insert_or_update_many, _column_fields
+
+
+# NumPy dtype kinds whose Python scalars are sent as they are to fields of
+# these types
+_SCALAR_KINDS = dict(
+    [(t, 'iu') for t in ('SmallIntegerField', 'IntegerField',
+                         'BigIntegerField', 'PositiveSmallIntegerField',
+                         'PositiveIntegerField', 'PositiveBigIntegerField')]
+    + [('FloatField', 'f'), ('BooleanField', 'b'),
+       ('NullBooleanField', 'b')])
+
+
+def _column_values(series, field, con):
+    """Convert a column to an array of values for `field`, with None for
+    missing values.
+
+    :returns: A tuple with the values, and whether they are prepared for
+        the database by the conversion.
+    """
+    missing = series.isna().to_numpy()
+    dtype = series.dtype
+
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        # Naive UTC, as aware datetimes are sent by djangobulk.bulk
+        series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+        dtype = series.dtype
+
+    if pd.api.types.is_datetime64_dtype(dtype):
+        if isinstance(field, models.DateTimeField):
+            values = np.asarray(series.dt.to_pydatetime(), dtype=object)
+        else:
+            values = series.dt.date.to_numpy(dtype=object)
+        prepared = isinstance(field, models.DateField)
+    elif pd.api.types.is_timedelta64_dtype(dtype):
+        values = np.asarray(series.dt.to_pytimedelta(), dtype=object)
+        prepared = (isinstance(field, models.DurationField)
+                    and con.features.has_native_duration_field)
+    elif isinstance(field, models.UUIDField):
+        # UUID objects, as returned by the database for the key lookups
+        values = np.empty(len(series), dtype=object)
+        values[:] = [
+            v if m or isinstance(v, uuid.UUID) else uuid.UUID(str(v))
+            for v, m in zip(series.to_numpy(dtype=object), missing)
+        ]
+        prepared = con.features.has_native_uuid_field
+    else:
+        # NumPy scalars become Python scalars the driver can adapt
+        values = series.to_numpy(dtype=object)
+        prepared = dtype.kind in _SCALAR_KINDS.get(
+            field.get_internal_type(), '')
+
+    if missing.any():
+        values = np.where(missing, None, values)
+    return (values, prepared)
+
+
+def _frame_rows(model, frame, columns=None, using="default"):
+    """Return the field names of the columns of `frame`, those of the
+    columns prepared for the database by their conversion, and an iterator
+    of its rows.
+
+    :param frame: A DataFrame, a structured array or a 2D array.
+    :param columns: A dict of field names by column of `frame`, or a list of
+        the columns named as fields. If None, all the columns of `frame`.
+        Required for 2D arrays, naming their columns.
+    :raises ValueError: if a column is not a field of the model, or a 2D
+        array has no columns.
+    """
+    if isinstance(frame, np.ndarray):
+        if frame.dtype.names is None:
+            if columns is None:
+                raise ValueError("Columns are required for 2D arrays")
+            frame = pd.DataFrame(frame, columns=list(columns))
+        else:
+            frame = pd.DataFrame(frame)
+
+    if columns is None:
+        columns = list(frame.columns)
+    if isinstance(columns, dict):
+        mapping = OrderedDict(columns)
+    else:
+        mapping = OrderedDict((c, c) for c in columns)
+
+    names = list(mapping.values())
+    fields = _column_fields(model, names)
+    con = connections[using]
+    values, prepared = [], []
+    for c, name, f in zip(mapping, names, fields):
+        column_values, column_prepared = _column_values(frame[c], f, con)
+        values.append(column_values)
+        if column_prepared:
+            prepared.append(name)
+    return (names, prepared, zip(*values))
+
+
+def _copy_method(method, using):
+    # COPY is the fastest path where available
+    if method is None and connections[using].vendor == 'postgresql':
+        return 'copy'
+    return method
+
+
+def insert_many_frame(model, frame, using="default", columns=None,
+                      method=None, rows_per_statement=None,
+                      max_parameters=None, batch_size=None):
+    '''
+    Bulk insert the rows of a DataFrame or NumPy array, see
+    `djangobulk.bulk.insert_many`.
+
+    :param model: Django model class.
+    :param frame: A DataFrame, a structured array, or a 2D array.
+    :param using: Database to use.
+    :param columns: A dict of field names, or attribute names, by column of
+        `frame`, or a list of the columns named as fields. If None, all the
+        columns of `frame`. Required for 2D arrays, naming their columns.
+        Fields that are not columns get their default.
+    :param method: 'values', 'executemany' or 'copy'. Defaults to 'copy' on
+        PostgreSQL, 'executemany' otherwise.
+    :param rows_per_statement: Maximum rows per statement for the 'values'
+        method.
+    :param max_parameters: Maximum parameters per statement for the 'values'
+        method.
+    :param batch_size: Maximum rows sent per batch.
+    :returns: The number of rows inserted.
+    :raises ValueError: if a column is not a field of the model, or the
+        arguments are invalid for `insert_many`.
+    '''
+    names, prepared, rows = _frame_rows(model, frame, columns, using)
+    return insert_many(model, rows, using=using,
+                       method=_copy_method(method, using),
+                       rows_per_statement=rows_per_statement,
+                       max_parameters=max_parameters, batch_size=batch_size,
+                       result='counts', columns=names,
+                       prepared_columns=prepared)
+
+
+def insert_or_update_many_frame(model, frame, keys=None, using="default",
+                                columns=None, skip_update=False,
+                                update_fields=None, exclude_fields=None,
+                                method='select', batch_size=None,
+                                skip_unchanged=False, dedup='last',
+                                result='counts'):
+    '''
+    Bulk insert or update the rows of a DataFrame or NumPy array, see
+    `djangobulk.bulk.insert_or_update_many`.
+
+    :param model: Django model class.
+    :param frame: A DataFrame, a structured array, or a 2D array.
+    :param keys: An iterable of field names to use in the WHERE clause on,
+        which must be columns. If none the model's primary key is used.
+    :param using: Database to use.
+    :param columns: Columns of `frame`, see `insert_many_frame`.
+    :param skip_update: Flag to insert only non-existing rows.
+    :param update_fields: An iterable of field names to be updated. If none,
+        the columns are updated.
+    :param exclude_fields: An iterable of field names to be excluded from
+        the set of model fields to be updated.
+    :param method: 'select', 'on_conflict' or 'staging'.
+    :param batch_size: Maximum rows processed per batch.
+    :param skip_unchanged: Only update rows where at least one updated field
+        changed.
+    :param dedup: 'last', 'first' or 'raise', for rows sharing their keys.
+    :param result: Format of the returned rows, 'counts' by default.
+    :returns: As returned by `insert_or_update_many`.
+    :raises ValueError: if a column is not a field of the model, or the
+        arguments are invalid for `insert_or_update_many`.
+    '''
+    names, prepared, rows = _frame_rows(model, frame, columns, using)
+    return insert_or_update_many(
+        model, rows, keys=keys, using=using, skip_update=skip_update,
+        update_fields=update_fields, exclude_fields=exclude_fields,
+        method=method, batch_size=batch_size, skip_unchanged=skip_unchanged,
+        dedup=dedup, result=result, columns=names, prepared_columns=prepared)
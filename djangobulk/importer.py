@@ -0,0 +1,212 @@
+'''
+Streaming import of CSV and JSON Lines files into a model.
+
+The file is read line by line and its rows are fed as raw rows to
+`djangobulk.bulk` in batches, so memory is bounded by the batch size
+whatever the size of the file. Values are sent as read, the database
+preparation of each field converting them.
+
+'''
+import csv
+import gzip
+import io
+import json
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import chain
+
+from django.db import models
+
+from djangobulk.bulk import insert_many, insert_or_update_many, _column_fields
+
+FILE_FORMATS = ('csv', 'jsonl')
+
+DEFAULT_IMPORT_BATCH_SIZE = 10000
+
+_EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+try:
+    # Python 2: paths may be str or unicode
+    _string_types = basestring  # noqa
+except NameError:
+    _string_types = str
+
+
+def _file_format(name, format=None):
+    """Return the format of the file `name`, found from its extension if
+    `format` is None.
+
+    :raises ValueError: if the format is unknown.
+    """
+    if format is None:
+        if name.endswith('.gz'):
+            name = name[:-3]
+        format = _EXTENSIONS.get(os.path.splitext(name)[1].lower())
+        if format is None:
+            raise ValueError("Unknown file format of %r, set the format"
+                             % (name,))
+    elif format not in FILE_FORMATS:
+        raise ValueError("Unknown file format: %r" % (format,))
+    return format
+
+
+@contextmanager
+def _open(source, encoding):
+    """Yield the lines of `source`, a path or a text file, closing the file
+    only if it was opened here. Paths ending with .gz are decompressed."""
+    if not isinstance(source, _string_types):
+        yield source
+        return
+
+    if source.endswith('.gz'):
+        # Buffered for Python 2, whose GzipFile has no read1
+        f = io.TextIOWrapper(io.BufferedReader(gzip.open(source, 'rb')),
+                             encoding=encoding, newline='')
+    else:
+        f = io.open(source, encoding=encoding, newline='')
+    with f:
+        yield f
+
+
+def _mapping(names, columns=None):
+    """Return the field names by column of the file, whose columns are
+    `names`."""
+    if columns is None:
+        return OrderedDict((n, n) for n in names)
+    if isinstance(columns, dict):
+        return OrderedDict(columns)
+    return OrderedDict((c, c) for c in columns)
+
+
+def _empty_value(field):
+    # CSV can't tell NULL from an empty string: empty is only kept for
+    # text fields that can't be NULL
+    if isinstance(field, (models.CharField, models.TextField)):
+        if not field.null:
+            return ''
+    return None
+
+
+def _csv_rows(model, lines, columns=None, delimiter=','):
+    """Return the field names of the columns of a CSV file with a header
+    line, and an iterator of its rows, or None if the file is empty.
+
+    :raises ValueError: if a column is not in the header or not a field of
+        the model.
+    """
+    reader = csv.reader(lines, delimiter=delimiter)
+    header = next(reader, None)
+    if header is None:
+        return None
+
+    mapping = _mapping(header, columns)
+    missing = [c for c in mapping if c not in header]
+    if missing:
+        raise ValueError("Columns not in the file header: %s"
+                         % ", ".join(missing))
+    names = list(mapping.values())
+    fields = _column_fields(model, names)
+    get = [(header.index(c), _empty_value(f))
+           for c, f in zip(mapping, fields)]
+
+    def rows():
+        try:
+            for line in reader:
+                if line:
+                    yield tuple([line[i] or empty for i, empty in get])
+        except IndexError:
+            raise ValueError("Line %d has only %d columns"
+                             % (reader.line_num, len(line)))
+
+    return (names, rows())
+
+
+def _jsonl_rows(model, lines, columns=None):
+    """Return the field names of the columns of a JSON Lines file, and an
+    iterator of its rows, or None if the file is empty.
+
+    Without `columns`, the keys of the first object are the columns. Keys
+    missing from an object are null.
+
+    :raises ValueError: if a column is not a field of the model.
+    """
+    objects = (json.loads(line) for line in lines if line.strip())
+    first = next(objects, None)
+    if first is None:
+        return None
+
+    mapping = _mapping(list(first), columns)
+    names = list(mapping.values())
+    _column_fields(model, names)
+    keys = list(mapping)
+    return (names, (tuple([o.get(k) for k in keys])
+                    for o in chain([first], objects)))
+
+
+def bulk_import(model, source, keys=None, format=None, columns=None,
+                using="default", batch_size=DEFAULT_IMPORT_BATCH_SIZE,
+                method=None, skip_update=False, update_fields=None,
+                dedup='last', delimiter=',', encoding='utf-8'):
+    '''
+    Stream a CSV or JSON Lines file into a model, inserting its rows with
+    `djangobulk.bulk.insert_many`, or inserting or updating them with
+    `djangobulk.bulk.insert_or_update_many` if keys are given.
+
+    CSV files must start with a header line naming the columns, and blank
+    lines are skipped. Empty CSV values are NULL, except for text fields
+    that can't be NULL.
+
+    :param model: Django model class.
+    :param source: Path of the file, decompressed if it ends with .gz, or
+        a file object open in text mode.
+    :param keys: An iterable of field names to use in the WHERE clause on,
+        which must be columns. If None the rows are only inserted.
+    :param format: 'csv' or 'jsonl'. If None, found from the extension of
+        the file name: .csv, .jsonl or .ndjson.
+    :param columns: A dict of field names, or attribute names, by column
+        of the file, or a list of the columns named as fields. If None, all
+        the columns of the file, named as fields. Fields that are not
+        columns get their default.
+    :param using: Database to use.
+    :param batch_size: Maximum rows read and written per batch.
+    :param method: Insert method, or upsert method if keys are given.
+    :param skip_update: Flag to insert only non-existing rows.
+    :param update_fields: An iterable of field names to be updated. If
+        none, the columns are updated.
+    :param dedup: 'last', 'first' or 'raise', for rows of a batch sharing
+        their keys.
+    :param delimiter: Delimiter of the CSV values.
+    :param encoding: Encoding of the file, if a path.
+    :returns: A tuple with the numbers of inserted and updated rows.
+    :raises ValueError: if the format is unknown, a column is not in the
+        file or not a field of the model, a CSV line is too short, or the
+        arguments are invalid for `insert_many` or `insert_or_update_many`.
+    :raises django.core.exceptions.ValidationError: if a value is invalid
+        for its field.
+    '''
+    if isinstance(source, _string_types):
+        name = source
+    else:
+        name = getattr(source, 'name', '')
+    format = _file_format(name, format)
+
+    with _open(source, encoding) as lines:
+        if format == 'csv':
+            read = _csv_rows(model, lines, columns, delimiter)
+        else:
+            read = _jsonl_rows(model, lines, columns)
+        if read is None:
+            return (0, 0)
+        names, rows = read
+
+        if keys is None:
+            inserted = insert_many(
+                model, rows, using=using, method=method,
+                batch_size=batch_size, result='counts', columns=names)
+            return (inserted, 0)
+        return insert_or_update_many(
+            model, rows, keys=keys, using=using, skip_update=skip_update,
+            update_fields=update_fields, method=method or 'select',
+            batch_size=batch_size, dedup=dedup, result='counts',
+            columns=names)
@@ -0,0 +1,114 @@
+'''
+Stream a CSV or JSON Lines file into a model.
+
+    $ python manage.py bulk_import shop.Product products.csv.gz \
+        --map sku --map title=name --map price_cents=price \
+        --keys sku --batch-size 10000
+
+Requires 'djangobulk' in INSTALLED_APPS. See
+`djangobulk.importer.bulk_import`.
+
+'''
+import sys
+from collections import OrderedDict
+
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from djangobulk.bulk import DEDUP_POLICIES
+from djangobulk.importer import (DEFAULT_IMPORT_BATCH_SIZE, FILE_FORMATS,
+                                 bulk_import)
+
+
+def _columns(maps):
+    """Return the field names by column of the --map options, or None."""
+    if not maps:
+        return None
+    columns = OrderedDict()
+    for m in maps:
+        column, _, field = m.partition('=')
+        columns[column] = field or column
+    return columns
+
+
+def _names(value):
+    return [name for name in value.split(',') if name] if value else None
+
+
+class Command(BaseCommand):
+    help = ("Stream a CSV or JSON Lines file into a model, inserting its "
+            "rows, or inserting or updating them by key.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'model', help="Model to import into, as app_label.ModelName.")
+        parser.add_argument(
+            'path', help="File to import, decompressed if it ends with .gz, "
+                         "or - for the standard input.")
+        parser.add_argument(
+            '--format', choices=FILE_FORMATS,
+            help="File format, found from the file extension by default.")
+        parser.add_argument(
+            '--map', action='append', dest='maps', metavar='COLUMN[=FIELD]',
+            help="Import a column of the file into a field, of the same "
+                 "name by default. Repeat for each column. All the columns "
+                 "are imported by default.")
+        parser.add_argument(
+            '--keys',
+            help="Comma separated key fields: rows with existing keys are "
+                 "updated. Rows are only inserted by default.")
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_IMPORT_BATCH_SIZE,
+            help="Rows read and written per batch.")
+        parser.add_argument(
+            '--method',
+            help="Insert method, or upsert method with --keys.")
+        parser.add_argument(
+            '--skip-update', action='store_true',
+            help="Only insert the rows with new keys.")
+        parser.add_argument(
+            '--update-fields',
+            help="Comma separated fields updated, the columns by default.")
+        parser.add_argument(
+            '--dedup', choices=DEDUP_POLICIES, default='last',
+            help="Row written among the rows of a batch sharing their keys.")
+        parser.add_argument(
+            '--delimiter', default=',',
+            help="Delimiter of the CSV values.")
+        parser.add_argument(
+            '--encoding', default='utf-8',
+            help="Encoding of the file.")
+        parser.add_argument(
+            '--database', default='default',
+            help="Database to import into.")
+
+    def handle(self, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+
+        source = options['path']
+        if source == '-':
+            if options['format'] is None:
+                raise CommandError("--format is required for the standard "
+                                   "input")
+            source = sys.stdin
+
+        try:
+            inserted, updated = bulk_import(
+                model, source, keys=_names(options['keys']),
+                format=options['format'], columns=_columns(options['maps']),
+                using=options['database'], batch_size=options['batch_size'],
+                method=options['method'],
+                skip_update=options['skip_update'],
+                update_fields=_names(options['update_fields']),
+                dedup=options['dedup'], delimiter=options['delimiter'],
+                encoding=options['encoding'])
+        except (IOError, ValueError, ValidationError) as e:
+            raise CommandError(e)
+
+        if options['verbosity'] > 0:
+            self.stdout.write("Inserted %d and updated %d rows of %s."
+                              % (inserted, updated, model._meta.label))
@@ -0,0 +1,152 @@
+'''
+Parallel bulk insert or update over several database connections.
+
+'''
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+from django.db import connections
+
+from djangobulk.bulk import (get_write_plan, insert_or_update_many,
+                             _check_result, _column_fields, _format_rows,
+                             _row_plan)
+
+
+class ParallelWriteError(Exception):
+    """Some partitions of a parallel write failed.
+
+    Each partition is written in its own transaction, so the partitions that
+    succeeded stay committed while the failed ones are rolled back.
+
+    :ivar results: The result of each partition, None for failed ones.
+    :ivar errors: A dict of the exception of each failed partition, by
+        partition index.
+    """
+
+    def __init__(self, results, errors):
+        super(ParallelWriteError, self).__init__(
+            "%d of %d partitions failed: %s" % (
+                len(errors), len(results),
+                "; ".join("%d: %r" % (i, e)
+                          for i, e in sorted(errors.items())))
+        )
+        self.results = results
+        self.errors = errors
+
+
+def _partition(plan, objects, partitions):
+    """Split objects by a hash of their keys, so a key is in one partition."""
+    con = connections[plan.using]
+    prepare_keys = plan.prepare_keys
+    parts = [[] for _ in range(partitions)]
+    for o in objects:
+        parts[hash(prepare_keys(o, con)) % partitions].append(o)
+    return parts
+
+
+def _combine(parts, result):
+    """Combine the rows of the partitions, in the format `result`."""
+    if result == 'counts':
+        return sum(parts)
+    elif result == 'tuples':
+        return (parts[0][0], [p for (_, rows) in parts for p in rows])
+    elif result == 'columns':
+        return OrderedDict((name, [v for part in parts for v in part[name]])
+                           for name in parts[0])
+    elif result == 'iterator':
+        return chain.from_iterable(parts)
+    return [row for part in parts for row in part]
+
+
+def _write_partition(model, objects, using, kwargs):
+    try:
+        return insert_or_update_many(model, objects, using=using, **kwargs)
+    finally:
+        # Each worker thread has its own connection
+        connections[using].close()
+
+
+def parallel_insert_or_update_many(model, objects, keys=None,
+                                   using="default", workers=4,
+                                   skip_update=False, update_fields=None,
+                                   exclude_fields=None, method='select',
+                                   batch_size=None, skip_unchanged=False,
+                                   dedup='last', result='dicts',
+                                   columns=None):
+    '''
+    Bulk insert or update Django objects over several connections at once.
+
+    The objects are partitioned by a hash of their key fields, so no two
+    partitions hold the same key, and each partition is written by
+    `insert_or_update_many` in a thread with its own connection and
+    transaction. The calling thread's transaction is not used, so the
+    workers do not see its uncommitted changes.
+
+    :param model: Django model class.
+    :param objects: Iterable of objects of class `model`.
+    :param keys: An iterable of field names to use in the WHERE clause on. If
+        none the model's primary key is used.
+    :param using: Database to use.
+    :param workers: Number of partitions and concurrent connections.
+    :param skip_update: Flag to insert only non-existing objects.
+    :param update_fields: An iterable of field names to be updated. If none
+        or empty, all fields of the model are updated.
+    :param exclude_fields: An iterable of field names to be excluded from
+        the set of model fields to be updated.
+    :param method: 'select', 'on_conflict' or 'staging'.
+    :param batch_size: Maximum objects processed per batch in a partition.
+    :param skip_unchanged: Only update rows where at least one updated field
+        changed.
+    :param dedup: 'last', 'first' or 'raise', see `insert_or_update_many`.
+        Objects sharing their keys are always in the same partition.
+    :param result: Format of the returned rows, see `insert_many`.
+    :param columns: Field names of raw rows given as `objects`, see
+        `insert_or_update_many`.
+    :returns: The results of all partitions combined, as returned by
+        `insert_or_update_many`.
+    :raises ValueError: if workers is not positive, result is unknown, or
+        the arguments are invalid for `insert_or_update_many`.
+    :raises ParallelWriteError: if any partition failed. The other
+        partitions are committed.
+    '''
+    if workers < 1:
+        raise ValueError("workers must be a positive integer")
+    _check_result(result)
+
+    if columns is not None and update_fields is None:
+        update_fields = [f.name for f in _column_fields(model, columns)]
+    plan = get_write_plan(model, keys, update_fields, exclude_fields, using)
+    kwargs = dict(keys=keys, skip_update=skip_update,
+                  update_fields=update_fields, exclude_fields=exclude_fields,
+                  method=method, batch_size=batch_size,
+                  skip_unchanged=skip_unchanged, dedup=dedup,
+                  result=result, columns=columns)
+    if columns is not None:
+        plan, objects = _row_plan(plan, objects, columns)
+
+    partitions = _partition(plan, objects, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_write_partition, model, part, using, kwargs)
+            if part else None
+            for part in partitions
+        ]
+
+    names = [f.name for f in plan.fields]
+    param_names = [f.name for f in plan.param_fields]
+    empty = (names, param_names, param_names)[:3 if skip_unchanged else 2]
+    results, errors = [], {}
+    for i, future in enumerate(futures):
+        if future is None:
+            results.append(tuple(_format_rows(n, [], result)
+                                 for n in empty))
+        elif future.exception() is not None:
+            results.append(None)
+            errors[i] = future.exception()
+        else:
+            results.append(future.result())
+    if errors:
+        raise ParallelWriteError(results, errors)
+
+    return tuple(_combine(parts, result) for parts in zip(*results))
@@ -0,0 +1,126 @@
+'''
+Server-side prepared statement cache for the bulk operations.
+
+Enabled by setting `DJANGOBULK_PREPARED_STATEMENTS` to the maximum number
+of statements prepared per connection. The statements issued by
+`djangobulk.bulk` on PostgreSQL are then prepared once with PREPARE, keyed
+on their SQL, and run with EXECUTE, so that repeated batch shapes are not
+parsed and planned again. The least recently used statements are
+deallocated when the cache is full.
+
+'''
+from collections import OrderedDict
+from itertools import count
+
+from django.conf import settings
+from django.db import connections
+
+from djangobulk.tracing import record_statement, record_statements
+
+
+# Statement names are unique per process
+_counter = count()
+
+
+class StatementCache(object):
+    """LRU cache of the statements prepared on a database connection.
+
+    Statements only live as long as the database session, so the cache is
+    reset when Django reconnects.
+
+    :param max_size: Maximum number of prepared statements.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._names = OrderedDict()
+        self._session = None
+
+    def _check_session(self, con):
+        # A new session does not have the statements prepared by the
+        # previous one
+        if self._session is not con.connection:
+            self._names.clear()
+            self._session = con.connection
+
+    def _prepare(self, con, cursor, sql):
+        """Return the name of the statement prepared for `sql`."""
+        self._check_session(con)
+
+        name = self._names.pop(sql, None)
+        if name is None:
+            while len(self._names) >= self.max_size:
+                _, old = self._names.popitem(last=False)
+                cursor.execute("DEALLOCATE %s" % old)
+
+            name = "djangobulk_%d" % next(_counter)
+            parts = sql.split("%s")
+            cursor.execute("PREPARE %s AS %s" % (name, "".join(
+                part + ("$%d" % i if i < len(parts) else "")
+                for i, part in enumerate(parts, 1)
+            )))
+
+        # Most recently used last
+        self._names[sql] = name
+        return name
+
+    def _execute_sql(self, name, num_params):
+        if not num_params:
+            return "EXECUTE %s" % name
+        return "EXECUTE %s (%s)" % (name, ",".join(["%s"] * num_params))
+
+    def execute(self, con, cursor, sql, params):
+        name = self._prepare(con, cursor, sql)
+        cursor.execute(self._execute_sql(name, len(params)), params)
+
+    def executemany(self, con, cursor, sql, params_list):
+        name = self._prepare(con, cursor, sql)
+        cursor.executemany(self._execute_sql(name, sql.count("%s")),
+                           params_list)
+
+    def clear(self, con, cursor):
+        """Deallocate the statements prepared in the current session."""
+        self._check_session(con)
+        while self._names:
+            _, name = self._names.popitem()
+            cursor.execute("DEALLOCATE %s" % name)
+
+
+def _statement_cache(con):
+    """Return the statement cache of the connection, or None if disabled."""
+    max_size = getattr(settings, 'DJANGOBULK_PREPARED_STATEMENTS', 0)
+    if not max_size or con.vendor != 'postgresql':
+        return None
+    cache = getattr(con, '_djangobulk_statements', None)
+    if cache is None:
+        cache = con._djangobulk_statements = StatementCache(max_size)
+    cache.max_size = max_size
+    return cache
+
+
+def execute(con, cursor, sql, params):
+    """Execute `sql`, as a prepared statement if the cache is enabled."""
+    record_statement(params)
+    cache = _statement_cache(con)
+    if cache is None:
+        cursor.execute(sql, params)
+    else:
+        cache.execute(con, cursor, sql, params)
+
+
+def executemany(con, cursor, sql, params_list):
+    """Execute `sql` for each parameters, prepared if the cache is enabled."""
+    params_list = record_statements(params_list)
+    cache = _statement_cache(con)
+    if cache is None:
+        cursor.executemany(sql, params_list)
+    else:
+        cache.executemany(con, cursor, sql, params_list)
+
+
+def clear_prepared_statements(using="default"):
+    """Deallocate the statements prepared on the connection of `using`."""
+    con = connections[using]
+    cache = getattr(con, '_djangobulk_statements', None)
+    if cache is not None and con.connection is not None:
+        cache.clear(con, con.cursor())
@@ -0,0 +1,260 @@
+'''
+Timing and tracing hooks for the bulk operations.
+
+Listeners registered with `add_listener`, or a `Tracer` used as a context
+manager, receive a `Phase` for each phase of each batch of a bulk call (e.g.
+preparing the values, selecting the existing keys, updating, filtering the
+duplicates, inserting), and one for the whole call. When no listener is
+registered, the hooks return immediately and nothing is measured.
+
+Values prepared lazily while they are sent, as by `insert_many`, are
+accounted to the phase sending them.
+
+'''
+import threading
+from collections import OrderedDict
+from timeit import default_timer as _timer
+
+
+_listeners = []
+
+_local = threading.local()
+
+
+class Phase(object):
+    """Measurements of one phase of a bulk operation.
+
+    :ivar operation: Name of the bulk function, e.g. 'insert_many', or None
+        outside of one.
+    :ivar model: Model class written.
+    :ivar using: Database alias.
+    :ivar name: Phase name: 'prepare', 'select', 'update', 'filter',
+        'insert', 'upsert', 'copy' or 'delete', or 'call' for the whole
+        call.
+    :ivar batch: Index of the batch in the call, None for the whole call.
+    :ivar rows: Number of rows processed.
+    :ivar statements: Number of statements executed.
+    :ivar bytes: Approximate size of the parameters sent, in bytes.
+    :ivar elapsed: Elapsed time, in seconds.
+    """
+
+    def __init__(self, operation, model, using, name, batch, rows=0):
+        self.operation = operation
+        self.model = model
+        self.using = using
+        self.name = name
+        self.batch = batch
+        self.rows = rows
+        self.statements = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return ("<Phase %s.%s batch=%r rows=%d statements=%d bytes=%d "
+                "elapsed=%.6f>" % (self.operation, self.name, self.batch,
+                                   self.rows, self.statements, self.bytes,
+                                   self.elapsed))
+
+    def __enter__(self):
+        self._outer = getattr(_local, 'phase', None)
+        _local.phase = self
+        self._start = _timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = _timer() - self._start
+        _local.phase = self._outer
+        del self._outer
+        _notify(self)
+        return False
+
+    def add(self, rows=0, statements=0, bytes=0):
+        self.rows += rows
+        self.statements += statements
+        self.bytes += bytes
+
+    def count(self, iterable):
+        """Iterate over `iterable`, counting its items as rows."""
+        for item in iterable:
+            self.rows += 1
+            yield item
+
+
+class _Call(Phase):
+    """The 'call' phase, totalling the statements of its batches."""
+
+    def __init__(self, operation, model, using):
+        super(_Call, self).__init__(operation, model, using, 'call', None)
+        self.batches = 0
+
+    def __enter__(self):
+        self._outer_call = getattr(_local, 'call', None)
+        _local.call = self
+        return super(_Call, self).__enter__()
+
+    def __exit__(self, *exc_info):
+        _local.call = self._outer_call
+        del self._outer_call
+        return super(_Call, self).__exit__(*exc_info)
+
+
+class _NullPhase(object):
+    """Phase used when no listener is registered, measuring nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, rows=0, statements=0, bytes=0):
+        pass
+
+    def count(self, iterable):
+        return iterable
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def _notify(phase):
+    for listener in list(_listeners):
+        listener(phase)
+
+
+def add_listener(callback):
+    """Call `callback` with each finished `Phase`, from any thread."""
+    _listeners.append(callback)
+
+
+def remove_listener(callback):
+    """Stop calling `callback`.
+
+    :raises ValueError: if callback is not a listener.
+    """
+    _listeners.remove(callback)
+
+
+def call(operation, plan):
+    """Return a context manager measuring a bulk call writing with `plan`."""
+    if not _listeners:
+        return _NULL_PHASE
+    return _Call(operation, plan.model, plan.using)
+
+
+def phase(name, rows=0):
+    """Return a context manager measuring a phase of the current batch."""
+    if not _listeners:
+        return _NULL_PHASE
+    current = getattr(_local, 'call', None)
+    if current is None:
+        return Phase(None, None, None, name, None, rows)
+    return Phase(current.operation, current.model, current.using, name,
+                 current.batches - 1, rows)
+
+
+def batches(batches):
+    """Iterate over the object batches of the current call, numbering
+    them."""
+    current = getattr(_local, 'call', None) if _listeners else None
+    if current is None:
+        return batches
+    return _numbered(current, batches)
+
+
+def _numbered(current, batches):
+    for batch in batches:
+        current.batches += 1
+        if hasattr(batch, '__len__'):
+            current.rows += len(batch)
+            yield batch
+        else:
+            # A single batch of all the objects, counted as consumed
+            yield current.count(batch)
+
+
+def _size(value):
+    """Approximate size of a parameter value, in bytes."""
+    value = getattr(value, 'adapted', value)
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray, memoryview, type(u''))):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(_size(v) for v in value)
+    return 8
+
+
+def _record(params):
+    _add_statement(sum(_size(v) for v in params))
+
+
+def _add_statement(size):
+    current = getattr(_local, 'phase', None)
+    if current is not None:
+        current.add(statements=1, bytes=size)
+    outer = getattr(_local, 'call', None)
+    if outer is not None and outer is not current:
+        outer.add(statements=1, bytes=size)
+
+
+def record_statement(params):
+    """Account a statement run with `params` to the current phase."""
+    if _listeners:
+        _record(params)
+
+
+def record_statements(params_list):
+    """Account a statement for each parameters of `params_list` as they are
+    iterated."""
+    if not _listeners:
+        return params_list
+    return _recorded(params_list)
+
+
+def _recorded(params_list):
+    for params in params_list:
+        _record(params)
+        yield params
+
+
+def record_copy(size):
+    """Account a COPY statement sending `size` bytes to the current phase."""
+    if _listeners:
+        _add_statement(size)
+
+
+class Tracer(object):
+    """Context manager collecting the phases of the bulk calls made while
+    it is active, in any thread.
+
+    :ivar phases: List of the finished `Phase`, in order.
+    """
+
+    def __init__(self):
+        self.phases = []
+
+    def __enter__(self):
+        add_listener(self.phases.append)
+        return self
+
+    def __exit__(self, *exc_info):
+        remove_listener(self.phases.append)
+        return False
+
+    def summary(self):
+        """Total the rows, statements, bytes and elapsed time by phase name.
+
+        :returns: An OrderedDict of dicts, by phase name in order of first
+            appearance.
+        """
+        totals = OrderedDict()
+        for p in self.phases:
+            total = totals.setdefault(p.name, dict(
+                count=0, rows=0, statements=0, bytes=0, elapsed=0.0))
+            total['count'] += 1
+            total['rows'] += p.rows
+            total['statements'] += p.statements
+            total['bytes'] += p.bytes
+            total['elapsed'] += p.elapsed
+        return totals
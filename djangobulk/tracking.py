@@ -0,0 +1,64 @@
+'''
+Dirty field tracking for partial bulk updates.
+
+'''
+
+
+def _concrete_fields(meta):
+    # Django < 1.6 has no concrete_fields
+    return getattr(meta, 'concrete_fields', meta.fields)
+
+
+class DirtyFieldsMixin(object):
+    """Model mixin remembering the field values loaded from the database.
+
+    `update_many(..., only_dirty=True)` uses it to only write the fields
+    that changed since the object was loaded, saved or marked clean::
+
+        class Product(DirtyFieldsMixin, models.Model):
+            ...
+
+    Values are compared with `!=`, so changes made in place to mutable
+    values are not detected. Objects loaded from the database are only
+    tracked from Django 1.8, which calls `Model.from_db`.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(DirtyFieldsMixin, cls).from_db(db, field_names,
+                                                        values)
+        instance.mark_clean()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super(DirtyFieldsMixin, self).save(*args, **kwargs)
+        self.mark_clean()
+
+    def mark_clean(self):
+        """Remember the current field values as the database state."""
+        # Read __dict__ so that deferred fields are not loaded
+        self._clean_values = dict(
+            (f.attname, self.__dict__[f.attname])
+            for f in _concrete_fields(self._meta)
+            if f.attname in self.__dict__
+        )
+
+    def get_dirty_fields(self):
+        """Return the names of the fields changed since the clean state.
+
+        :returns: A set of field names, or None if the object has no clean
+            state, i.e. it was not loaded from the database.
+        """
+        clean = getattr(self, '_clean_values', None)
+        if clean is None:
+            return None
+
+        dirty = set()
+        for f in _concrete_fields(self._meta):
+            if f.attname not in self.__dict__:
+                # Deferred and never assigned
+                continue
+            if (f.attname not in clean or
+                    self.__dict__[f.attname] != clean[f.attname]):
+                dirty.add(f.name)
+        return dirty
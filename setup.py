@@ -8,6 +8,16 @@ setup(
     cmdclass=versioneer.get_cmdclass(),
     author='Kevin Mahoney',
     author_email='kevin.mahoney@maplecroft.com',
-    packages=['djangobulk'],
-    install_requires=['Django >= 1.5', 'psycopg2'],
+    packages=['djangobulk', 'djangobulk.management',
+              'djangobulk.management.commands'],
+    install_requires=[
+        'Django >= 1.5',
+        'psycopg2',
+        # concurrent.futures, for djangobulk.parallel
+        'futures; python_version < "3"',
+    ],
+    extras_require={
+        'async': ['psycopg >= 3'],
+        'frames': ['pandas'],
+    },
     )